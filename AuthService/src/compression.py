@@ -0,0 +1,111 @@
+# Сжатие ответов gzip или brotli по Accept-Encoding. Сжимаются ответы,
+# отданные целиком, размером от COMPRESSION_MIN_SIZE байт; стримы (SSE)
+# и уже сжатые ответы проходят как есть. Сжатие больших списков занимает
+# миллисекунды, поэтому идёт в пуле потоков, а не в цикле событий.
+import gzip
+import os
+from threading import Lock
+
+import brotli
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+
+# Меньшие ответы не сжимаются; отрицательное значение отключает сжатие
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+# При равных q предпочитается первая
+ENCODINGS = ("br", "gzip")
+
+_stats = {encoding: {"responses": 0, "bytes_in": 0, "bytes_out": 0} for encoding in ENCODINGS}
+_stats_lock = Lock()
+
+
+def choose_encoding(accept_encoding: str):
+    # Возвращает br, gzip или None; q=0 запрещает кодировку
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODINGS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or COMPRESSION_MIN_SIZE < 0:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if "content-encoding" in headers or headers.get("content-type", "").startswith("text/event-stream"):
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            body = message.get("body", b"")
+            if message.get("more_body", False) or len(body) < COMPRESSION_MIN_SIZE:
+                # Стрим или маленький ответ
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            if encoding is not None:
+                compressed = await run_in_threadpool(compress, body, encoding)
+                with _stats_lock:
+                    stats = _stats[encoding]
+                    stats["responses"] += 1
+                    stats["bytes_in"] += len(body)
+                    stats["bytes_out"] += len(compressed)
+                body = compressed
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def collect_metrics() -> dict:
+    with _stats_lock:
+        return {encoding: dict(stats) for encoding, stats in _stats.items()}
@@ -1,15 +1,58 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, status
 from database import create_all_tables, get_db
+import database
+import tracing
+import query_budget
+import metrics
+import admission
+import compression
+import warmup
 import users.router, sessions.router
+import asyncio
 
 
 app = FastAPI()
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+engines = {database.engine, database.replica_engine}
+for traced_engine in engines:
+    tracing.instrument_engine(traced_engine)
+    query_budget.instrument_engine(traced_engine)
+tracing.instrument_sessions(database.SessionLocal)
+tracing.instrument_sessions(database.ReplicaSessionLocal)
 
 create_all_tables()
 
 app.include_router(users.router.router, prefix="/users", tags=["users"])
 app.include_router(sessions.router.router, prefix="/sessions", tags=["sessions"])
 
+metrics.register("tracing", tracing.collect_metrics)
+metrics.register("admission", admission.collect_metrics)
+metrics.register("compression", compression.collect_metrics)
+metrics.register("warmup", warmup.collect_metrics)
+
+@app.get("/metrics", tags=["metrics"])
+@query_budget.query_budget(0)
+def get_metrics():
+    return metrics.snapshot()
+
+@app.get("/ready", tags=["metrics"])
+@query_budget.query_budget(0)
+def get_ready():
+    # Для readiness-проверки балансировщика: трафик — только после прогрева
+    if not warmup.is_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Warming up",
+        )
+    return {"status": "ready"}
+
+@app.on_event("startup")
+async def startup_event():
+    asyncio.create_task(warmup.run_warmup(app, engines))
+
 # Запуск приложения
 if __name__ == "__main__":
     import uvicorn
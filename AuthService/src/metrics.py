@@ -0,0 +1,16 @@
+# Простой реестр метрик процесса, отдаётся через GET /metrics
+from threading import Lock
+
+_collectors = {}
+_lock = Lock()
+
+
+def register(name: str, collector):
+    with _lock:
+        _collectors[name] = collector
+
+
+def snapshot() -> dict:
+    with _lock:
+        collectors = dict(_collectors)
+    return {name: collector() for name, collector in collectors.items()}
@@ -0,0 +1,139 @@
+# Подсчёт SQL-запросов на один HTTP-запрос. У каждого обработчика объявлен
+# бюджет (@query_budget); превышение бюджета и многократное выполнение
+# одного и того же запроса (признак N+1) пишутся в лог, а в режиме raise
+# приводят к исключению — так бюджеты проверяются в тестах.
+import logging
+import os
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+from sqlalchemy import event
+
+# off — не считать, log — писать в лог (staging), raise — исключение (тесты)
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "off")
+# Сколько раз один и тот же запрос может выполниться за HTTP-запрос
+QUERY_REPEAT_THRESHOLD = int(os.getenv("QUERY_REPEAT_THRESHOLD", "5"))
+
+logger = logging.getLogger(__name__)
+
+_current_counter = ContextVar("query_counter", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    __slots__ = ("total", "statements", "lock")
+
+    def __init__(self):
+        self.total = 0
+        self.statements = Counter()
+        self.lock = Lock()
+
+    def record(self, statement: str):
+        with self.lock:
+            self.total += 1
+            self.statements[statement] += 1
+
+    def repeated(self, threshold: int) -> list:
+        with self.lock:
+            return [
+                (statement, count)
+                for statement, count in self.statements.items()
+                if count > threshold
+            ]
+
+
+def query_budget(max_queries: int):
+    def decorator(endpoint):
+        endpoint.query_budget = max_queries
+        return endpoint
+    return decorator
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        counter = _current_counter.get()
+        if counter is not None:
+            counter.record(statement)
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
+
+
+@contextmanager
+def assert_max_queries(max_queries: int):
+    with count_queries() as counter:
+        yield counter
+    if counter.total > max_queries:
+        raise QueryBudgetExceeded(
+            f"Expected at most {max_queries} queries, got {counter.total}"
+        )
+
+
+def check_budget(name: str, budget, counter: QueryCounter):
+    problems = []
+    if budget is None:
+        if counter.total:
+            problems.append(f"no query budget declared, ran {counter.total} queries")
+    elif counter.total > budget:
+        problems.append(f"ran {counter.total} queries, budget is {budget}")
+    for statement, count in counter.repeated(QUERY_REPEAT_THRESHOLD):
+        problems.append(f"statement executed {count} times: {statement[:200]}")
+
+    if not problems:
+        return
+    message = f"{name}: " + "; ".join(problems)
+    if QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(message)
+    logger.warning("Query budget violation in %s", message)
+
+
+class QueryBudgetMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or QUERY_BUDGET_MODE == "off":
+            await self.app(scope, receive, send)
+            return
+
+        counter = QueryCounter()
+        checked = False
+
+        async def send_checked(message):
+            nonlocal checked
+            if message["type"] == "http.response.start" and QUERY_BUDGET_MODE == "raise":
+                # До начала ответа: исключение станет ответом 500, а не
+                # оборванным ответом 200. Запросы, которые стрим (SSE)
+                # выполняет после начала ответа, в этом режиме не проверяются
+                checked = True
+                self.check(scope, counter)
+            await send(message)
+
+        token = _current_counter.set(counter)
+        try:
+            await self.app(scope, receive, send_checked)
+        finally:
+            _current_counter.reset(token)
+
+        if not checked:
+            self.check(scope, counter)
+
+    @staticmethod
+    def check(scope, counter: QueryCounter):
+        route = scope.get("route")
+        path = getattr(route, "path", None) or scope["path"]
+        budget = getattr(scope.get("endpoint"), "query_budget", None)
+        check_budget(f"{scope['method']} {path}", budget, counter)
@@ -0,0 +1,120 @@
+# Генератор синтетических пользователей для нагрузочных тестов.
+# Данные детерминированы: одинаковые --seed и --users дают одинаковые строки
+# здесь и в OrderService/src/seed.py (таблица user дублируется в базе заказов).
+# Загрузка через COPY в несколько процессов. Запуск из каталога src:
+#   python seed.py --users 1000000 --seed 42 --truncate
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from multiprocessing import Pool
+
+import bcrypt
+import psycopg2
+
+import models
+from database import DATABASE_URL, create_all_tables
+
+# bcrypt считается один раз для небольшого набора паролей; пользователь
+# с номером i получает пароль password{i % PASSWORD_POOL_SIZE}
+PASSWORD_POOL_SIZE = 16
+BCRYPT_ROUNDS = 12
+BCRYPT_ALPHABET = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+SEED_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def password_hashes(seed: int) -> list:
+    # Соль фиксирована сидом, поэтому хэши воспроизводимы
+    rng = random.Random(f"{seed}-bcrypt")
+    salt = "".join(rng.choice(BCRYPT_ALPHABET) for _ in range(21)) + rng.choice(".Oeu")
+    prefix = f"$2b${BCRYPT_ROUNDS:02d}${salt}".encode()
+    return [
+        bcrypt.hashpw(f"password{n}".encode(), prefix).decode()
+        for n in range(PASSWORD_POOL_SIZE)
+    ]
+
+
+def user_role(user_id: int) -> str:
+    if user_id % 10000 == 0:
+        return "manager"
+    if user_id % 1000 == 0:
+        return "chef"
+    return "customer"
+
+
+def user_rows(start: int, stop: int, hashes: list, total: int):
+    for user_id in range(start, stop):
+        created_at = SEED_EPOCH + timedelta(seconds=(user_id * 31536000) // total)
+        yield (
+            user_id,
+            f"user{user_id}",
+            f"user{user_id}@example.com",
+            hashes[user_id % len(hashes)],
+            user_role(user_id),
+            created_at.isoformat(),
+            created_at.isoformat(),
+        )
+
+
+USER_COLUMNS = "(id, username, email, password_hash, role, created_at, updated_at)"
+
+
+def copy_rows(cursor, table: str, columns: str, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} {columns} FROM STDIN", buffer)
+
+
+def load_users(args: tuple) -> int:
+    start, stop, hashes, total = args
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        with connection, connection.cursor() as cursor:
+            copy_rows(cursor, '"user"', USER_COLUMNS, user_rows(start, stop, hashes, total))
+    finally:
+        connection.close()
+    return stop - start
+
+
+def chunks(total: int, size: int):
+    for start in range(1, total + 1, size):
+        yield start, min(start + size, total + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load synthetic users into the AuthService database")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--truncate", action="store_true", help="Remove existing sessions and users first")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    create_all_tables()
+    hashes = password_hashes(args.seed)
+
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        with connection, connection.cursor() as cursor:
+            if args.truncate:
+                cursor.execute('TRUNCATE "session", "user" RESTART IDENTITY')
+
+        tasks = [(start, stop, hashes, args.users) for start, stop in chunks(args.users, args.chunk_size)]
+        with Pool(args.workers) as pool:
+            loaded = sum(pool.imap_unordered(load_users, tasks))
+
+        with connection, connection.cursor() as cursor:
+            cursor.execute("""SELECT setval(pg_get_serial_sequence('"user"', 'id'), COALESCE(MAX(id), 1)) FROM "user\"""")
+    finally:
+        connection.close()
+
+    print(f"Loaded {loaded} users in {time.monotonic() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,10 @@ from typing import List
 from dotenv import load_dotenv
 import os
 
-from database import get_db
+from database import SessionLocal, get_db
+from query_budget import query_budget
+from admission import limit_from_env
+import warmup
 from models import User
 from sessions.schemas import (
     SessionCreateRequest,
@@ -27,7 +30,15 @@ bearer_scheme = HTTPBearer()
 
 router = APIRouter()
 
-@router.post("/", response_model=SessionCreateResponse)
+# Проверка и вычисление bcrypt-хэша — самые дорогие операции сервиса.
+# Лимит общий для входа и записи паролей (users.router): частота на клиента
+# против перебора паролей и число одновременных хэшей, чтобы bcrypt не занял
+# процессор и не тормозил GET /users/{id}, от которого зависит OrderService.
+# По умолчанию хэши занимают не больше половины ядер.
+password_limit = limit_from_env("password", rate=1, burst=10, concurrency=max(1, (os.cpu_count() or 2) // 2))
+
+@router.post("/", response_model=SessionCreateResponse, dependencies=[Depends(password_limit)])
+@query_budget(1)
 def create_session(
     request: SessionCreateRequest,
     db: Session = Depends(get_db),
@@ -54,6 +65,7 @@ def create_session(
 
 
 @router.get("/", response_model=SessionInfoResponse)
+@query_budget(0)
 def get_session(token: str = Depends(bearer_scheme)):
     if not token:
         raise HTTPException(
@@ -74,3 +86,10 @@ def get_session(token: str = Depends(bearer_scheme)):
         )
 
     return payload
+
+
+def warm_queries(db: Session):
+    db.query(User).filter(User.email == "").first()
+
+
+warmup.register(warm_queries, SessionLocal)
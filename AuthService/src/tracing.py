@@ -0,0 +1,328 @@
+# Лёгкая трассировка запросов: спаны обработки маршрута, SQL-запросов,
+# коммитов и исходящих HTTP-вызовов. Контекст передаётся между сервисами
+# в заголовке traceparent (W3C Trace Context). Сэмплированные трассы
+# пишутся в файл в формате OTLP/JSON, медленные запросы — в лог целиком.
+import json
+import logging
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+SERVICE_NAME = os.getenv("SERVICE_NAME", "auth-service")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+# Пустое значение (по умолчанию) отключает экспорт в файл
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "500"))
+TRACE_MAX_SPANS = 1000
+SQL_STATEMENT_MAX_LENGTH = 500
+
+logger = logging.getLogger(__name__)
+
+# Виды спанов OTLP
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_current_span = ContextVar("current_span", default=None)
+_stats = {"traces": 0, "exported": 0, "dropped": 0, "slow_requests": 0}
+# Счётчики меняют потоки обработчиков и поток экспорта
+_stats_lock = threading.Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class Trace:
+    __slots__ = ("trace_id", "sampled", "spans", "lock")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans = []
+        self.lock = threading.Lock()
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, trace: Trace, parent_id: str, name: str, attributes: dict = None, kind: int = SPAN_KIND_INTERNAL):
+        self.trace = trace
+        self.kind = kind
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        with trace.lock:
+            if len(trace.spans) < TRACE_MAX_SPANS:
+                trace.spans.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns or time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _parse_traceparent(value: str):
+    parts = value.strip().split("-") if value else []
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        flags = int(parts[3], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def inject_headers() -> dict:
+    span = _current_span.get()
+    if span is None:
+        return {}
+    flags = "01" if span.trace.sampled else "00"
+    return {"traceparent": f"00-{span.trace.trace_id}-{span.span_id}-{flags}"}
+
+
+def begin_span(name: str, attributes: dict = None, kind: int = SPAN_KIND_INTERNAL):
+    # Спан без переключения текущего контекста (для SQL-запросов)
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    return Span(parent.trace, parent.span_id, name, attributes, kind)
+
+
+def end_span(span, error: str = None):
+    if span is None:
+        return
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = error
+
+
+@contextmanager
+def start_span(name: str, attributes: dict = None, kind: int = SPAN_KIND_INTERNAL):
+    span = begin_span(name, attributes, kind)
+    if span is None:
+        yield None
+        return
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.error = repr(e)
+        raise
+    finally:
+        span.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def _start_trace(name: str, traceparent: str, attributes: dict) -> Span:
+    parsed = _parse_traceparent(traceparent)
+    if parsed is not None:
+        trace_id, parent_id, sampled = parsed
+    else:
+        trace_id, parent_id = secrets.token_hex(16), None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    _count("traces")
+    return Span(Trace(trace_id, sampled), parent_id, name, attributes, SPAN_KIND_SERVER)
+
+
+def _finish_trace(root: Span, log_slow: bool):
+    root.end_ns = time.time_ns()
+    duration_ms = root.duration_ms
+    if log_slow and duration_ms >= TRACE_SLOW_REQUEST_MS:
+        _count("slow_requests")
+        logger.warning(
+            "Slow request %s %.1f ms trace=%s\n%s",
+            root.name, duration_ms, root.trace.trace_id, format_tree(root.trace),
+        )
+    if root.trace.sampled and TRACE_EXPORT_FILE:
+        try:
+            _export_queue.put_nowait(root.trace)
+        except queue.Full:
+            _count("dropped")
+
+
+def format_tree(trace: Trace) -> str:
+    with trace.lock:
+        spans = list(trace.spans)
+    children = {}
+    for span in spans:
+        children.setdefault(span.parent_id, []).append(span)
+    span_ids = {span.span_id for span in spans}
+    roots = [span for span in spans if span.parent_id not in span_ids]
+
+    lines = []
+
+    def walk(span: Span, depth: int):
+        line = f"{'  ' * depth}{span.name} {span.duration_ms:.1f} ms"
+        if span.error:
+            line += f" error={span.error}"
+        lines.append(line)
+        for child in sorted(children.get(span.span_id, []), key=lambda s: s.start_ns):
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 1)
+    return "\n".join(lines)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(trace: Trace) -> dict:
+    with trace.lock:
+        spans = list(trace.spans)
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": span.kind,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in span.attributes.items()
+            ],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 0},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+_export_queue = queue.Queue(maxsize=10000)
+
+
+def _export_worker():
+    # Запись в файл идёт в отдельном потоке, чтобы не блокировать запросы
+    while True:
+        trace = _export_queue.get()
+        try:
+            with open(TRACE_EXPORT_FILE, "a") as f:
+                f.write(json.dumps(_to_otlp(trace)) + "\n")
+            _count("exported")
+        except Exception:
+            _count("dropped")
+            logger.exception("Failed to export trace")
+
+
+if TRACE_EXPORT_FILE:
+    threading.Thread(target=_export_worker, name="trace-exporter", daemon=True).start()
+
+
+class TracingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        traceparent = headers.get(b"traceparent", b"").decode("latin-1")
+        root = _start_trace(
+            f"{scope['method']} {scope['path']}",
+            traceparent,
+            {"http.method": scope["method"], "http.target": scope["path"]},
+        )
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal streaming
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name.lower() == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+            await send(message)
+
+        token = _current_span.set(root)
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception as e:
+            root.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                root.name = f"{scope['method']} {route.path}"
+            # Длительность SSE-стрима не характеризует скорость обработки
+            _finish_trace(root, log_slow=not streaming)
+
+
+def instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = begin_span(
+            "sql",
+            {"db.system": "postgresql", "db.statement": statement[:SQL_STATEMENT_MAX_LENGTH]},
+            SPAN_KIND_CLIENT,
+        )
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        end_span(getattr(context, "_trace_span", None))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        context = exception_context.execution_context
+        if context is not None:
+            end_span(getattr(context, "_trace_span", None), repr(exception_context.original_exception))
+
+
+def instrument_sessions(session_factory):
+    @event.listens_for(session_factory, "before_commit")
+    def before_commit(session):
+        session.info["trace_commit_span"] = begin_span("db.commit")
+
+    @event.listens_for(session_factory, "after_commit")
+    def after_commit(session):
+        end_span(session.info.pop("trace_commit_span", None))
+
+    @event.listens_for(session_factory, "after_rollback")
+    def after_rollback(session):
+        end_span(session.info.pop("trace_commit_span", None), "rollback")
+
+
+def collect_metrics() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["export_queue"] = _export_queue.qsize()
+    stats["sample_rate"] = TRACE_SAMPLE_RATE
+    return stats
@@ -1,4 +1,6 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 import jwt
 from jwt.exceptions import PyJWTError, ExpiredSignatureError
@@ -19,13 +21,39 @@ bearer_scheme = HTTPBearer()
 
 import database
 import models
+from query_budget import query_budget
+from conditional import conditional_list, version_columns
+import warmup
+from sessions.router import password_limit
 import users.schemas
 
+users_table = models.User.__table__
+
+# Имена уникальных ограничений, которые Postgres даёт по умолчанию
+UNIQUE_VIOLATION = "23505"
+CONFLICT_MESSAGES = {
+    "user_email_key": "User with the provided email already exists",
+    "user_username_key": "User with the provided username already exists",
+}
+
+def raise_conflict(error: IntegrityError):
+    diag = getattr(error.orig, "diag", None)
+    detail = CONFLICT_MESSAGES.get(getattr(diag, "constraint_name", None))
+    if getattr(error.orig, "pgcode", None) != UNIQUE_VIOLATION or detail is None:
+        raise error
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=detail,
+    )
+
 @router.get("/", response_model=List[users.schemas.UserResponse])
+@query_budget(2)
 def get_users(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(database.get_db),
+    db: Session = Depends(database.get_read_db),
     token: str = Depends(bearer_scheme),
 ):
     try:
@@ -41,47 +69,46 @@ def get_users(
             detail="Could not validate credentials",
         )
 
+    # Версия считается по всей таблице: страница меняется и от вставок перед ней
+    not_modified = conditional_list(request, response, [
+        db.query(*version_columns(models.User.updated_at)).one(),
+    ])
+    if not_modified:
+        return not_modified
+
     users = db.query(models.User).offset(skip).limit(limit).all()
     return users
 
-@router.post("/", response_model=users.schemas.UserCreateResponse)
+@router.post("/", response_model=users.schemas.UserCreateResponse, dependencies=[Depends(password_limit)])
+@query_budget(1)
 def create_user(
     request: users.schemas.UserCreateRequest,
     db: Session = Depends(database.get_db),
 ):
-    existing_user = db.query(models.User).filter(
-        models.User.email == request.email
-    ).first()
-    if existing_user:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="User with the provided email already exists",
-        )
-
-    existing_username = db.query(models.User).filter(
-        models.User.username == request.username
-    ).first()
-    if existing_username:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail="User with the provided username already exists",
-        )
-
-    user = models.User(
-        username=request.username,
-        email=request.email,
-        password_hash=bcrypt.hash(request.password),
-        role=request.role,
-        created_at=datetime.utcnow(),
-        updated_at=datetime.utcnow(),
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    # Дубликаты ловит уникальный индекс: один INSERT вместо проверок заранее
+    now = datetime.utcnow()
+    try:
+        user = db.execute(
+            insert(users_table)
+            .values(
+                username=request.username,
+                email=request.email,
+                password_hash=bcrypt.hash(request.password),
+                role=request.role,
+                created_at=now,
+                updated_at=now,
+            )
+            .returning(*users_table.c)
+        ).one()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise_conflict(e)
 
     return {"message": "User created successfully", "user": user}
     
-@router.put("/", response_model=users.schemas.UserUpdateResponse)
+@router.put("/", response_model=users.schemas.UserUpdateResponse, dependencies=[Depends(password_limit)])
+@query_budget(1)
 def update_user(
     request: users.schemas.UserUpdateRequest,
     db: Session = Depends(database.get_db),
@@ -100,27 +127,34 @@ def update_user(
             detail="Could not validate credentials",
         )
 
-    user = db.query(models.User).filter(
-        models.User.id == payload.get("user_id"),
-    ).first()
+    values = {"updated_at": datetime.utcnow()}
+    if request.password:
+        values["password_hash"] = bcrypt.hash(request.password)
+    if request.role:
+        values["role"] = request.role
+
+    try:
+        user = db.execute(
+            update(users_table)
+            .where(users_table.c.id == payload.get("user_id"))
+            .values(**values)
+            .returning(*users_table.c)
+        ).first()
+        db.commit()
+    except IntegrityError as e:
+        db.rollback()
+        raise_conflict(e)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
         )
 
-    if request.password:
-        user.password_hash = bcrypt.hash(request.password)
-    if request.role:
-        user.role = request.role
-    user.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(user)
-
     return {"message": "User updated successfully", "user": user}
 
 @router.get("/me", response_model=users.schemas.UserResponse)
-def get_me(token: str = Depends(bearer_scheme), db: Session = Depends(database.get_db)):
+@query_budget(1)
+def get_me(token: str = Depends(bearer_scheme), db: Session = Depends(database.get_read_db)):
     try:
         payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
     except ExpiredSignatureError:
@@ -146,10 +180,14 @@ def get_me(token: str = Depends(bearer_scheme), db: Session = Depends(database.g
     return user
 
 @router.get("/{user_id}", response_model=users.schemas.UserResponse)
+@query_budget(1)
 def get_user(
     user_id: int,
     db: Session = Depends(database.get_db)
 ):
+    # Читается с primary: OrderService (auth_client) ходит сюда без куки
+    # read-your-writes и с реплики не увидел бы только что созданного
+    # пользователя или новую роль
     user = db.query(models.User).filter(
         models.User.id == user_id,
     ).first()
@@ -159,4 +197,20 @@ def get_user(
             detail="User not found",
         )
 
-    return user
\ No newline at end of file
+    return user
+
+
+def warm_queries(db: Session):
+    # Те же формы запросов, что у читающих обработчиков выше
+    db.query(*version_columns(models.User.updated_at)).one()
+    db.query(models.User).offset(0).limit(0).all()
+    db.query(models.User).filter(models.User.id == 0).first()
+
+
+def warm_primary_queries(db: Session):
+    # GET /users/{user_id}
+    db.query(models.User).filter(models.User.id == 0).first()
+
+
+warmup.register(warm_queries, database.ReplicaSessionLocal)
+warmup.register(warm_primary_queries, database.SessionLocal)
@@ -0,0 +1,31 @@
+# Тесты бюджетов запросов идут против настоящего Postgres из DB_* (.env);
+# без DB_HOST/DB_PORT или без базы они пропускаются
+import os
+import sys
+
+import pytest
+from dotenv import load_dotenv
+from sqlalchemy.exc import OperationalError
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+# DB_* берутся из .env сервиса, как в database.py
+load_dotenv()
+
+os.environ["QUERY_BUDGET_MODE"] = "raise"
+os.environ["ADMISSION_MODE"] = "off"
+os.environ["TRACE_EXPORT_FILE"] = ""
+os.environ.setdefault("JWT_SECRET", "test-secret")
+
+
+@pytest.fixture(scope="session")
+def app():
+    # database.py без DB_* не импортируется, поэтому тесты импортируют
+    # модули сервиса только после этой фикстуры
+    if not (os.getenv("DB_HOST") and os.getenv("DB_PORT")):
+        pytest.skip("DB_HOST and DB_PORT are not set")
+    try:
+        import main
+    except OperationalError as error:
+        pytest.skip(f"Postgres is not available: {error.orig}")
+    return main.app
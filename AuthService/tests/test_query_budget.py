@@ -0,0 +1,58 @@
+import os
+
+import jwt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from query_budget import QUERY_REPEAT_THRESHOLD, QueryBudgetExceeded, QueryBudgetMiddleware, query_budget
+
+
+@pytest.fixture
+def token():
+    return jwt.encode({"user_id": 1}, os.environ["JWT_SECRET"], algorithm="HS256")
+
+
+def test_get_users_within_budget(app, token):
+    client = TestClient(app)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    response = client.get("/users/", headers=headers)
+    assert response.status_code == 200
+
+    # 304 тоже укладывается в бюджет
+    response = client.get("/users/", headers={**headers, "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_exceeded_budget_fails_before_response(app, token, monkeypatch):
+    import users.router
+
+    monkeypatch.setattr(users.router.get_users, "query_budget", 0)
+    client = TestClient(app, raise_server_exceptions=False)
+
+    response = client.get("/users/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 500
+
+
+def test_repeated_statement_is_reported(app):
+    import database
+    import models
+
+    n_plus_one = FastAPI()
+    n_plus_one.add_middleware(QueryBudgetMiddleware)
+
+    @n_plus_one.get("/")
+    @query_budget(QUERY_REPEAT_THRESHOLD + 1)
+    def one_query_per_user():
+        db = database.SessionLocal()
+        try:
+            for user_id in range(QUERY_REPEAT_THRESHOLD + 1):
+                db.execute(select(models.User.id).where(models.User.id == user_id))
+        finally:
+            db.close()
+        return {}
+
+    with pytest.raises(QueryBudgetExceeded, match="statement executed"):
+        TestClient(n_plus_one).get("/")
@@ -0,0 +1,120 @@
+# Контроль допуска для дорогих обработчиков: token bucket на пару (лимит,
+# клиент) и предел одновременных запросов на лимит. Запрос сверх лимита
+# сразу получает 429 с Retry-After. Проверка асинхронная и не занимает
+# поток пула, поэтому дешёвые обработчики не ждут за отклонёнными запросами.
+# Подключается к маршруту через dependencies=[Depends(limit)].
+import math
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from fastapi import HTTPException, Request, status
+
+# enforce — отклонять, log — только считать отклонения (подбор лимитов), off — не проверять
+ADMISSION_MODE = os.getenv("ADMISSION_MODE", "enforce")
+# Сколько клиентов помнить на лимит; давно не приходившие вытесняются
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "10000"))
+
+_limits = []
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class AdmissionLimit:
+    def __init__(self, name: str, rate: float, burst: int, concurrency: int):
+        # rate — запросов в секунду на клиента, 0 — без ограничения;
+        # concurrency — одновременных запросов на лимит, 0 — без ограничения
+        self.name = name
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.stats = {"accepted": 0, "rejected_rate": 0, "rejected_concurrency": 0}
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+        _limits.append(self)
+
+    def _take_token(self, client: str, now: float):
+        # Возвращает None или через сколько секунд появится токен
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            if len(self._buckets) > ADMISSION_MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return None
+        return (1 - bucket.tokens) / self.rate
+
+    def admit(self, client: str):
+        # Возвращает None, если запрос допущен, иначе Retry-After в секундах
+        with self._lock:
+            if self.concurrency and self.in_flight >= self.concurrency:
+                self.stats["rejected_concurrency"] += 1
+                retry_after = 1
+            else:
+                retry_after = self._take_token(client, time.monotonic()) if self.rate else None
+                if retry_after is not None:
+                    self.stats["rejected_rate"] += 1
+                    retry_after = max(1, math.ceil(retry_after))
+            if retry_after is not None and ADMISSION_MODE == "enforce":
+                return retry_after
+            self.stats["accepted"] += 1
+            self.in_flight += 1
+            return None
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def __call__(self, request: Request):
+        if ADMISSION_MODE == "off":
+            yield
+            return
+        client = request.client.host if request.client else "unknown"
+        retry_after = self.admit(client)
+        if retry_after is not None:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(retry_after)},
+            )
+        try:
+            yield
+        finally:
+            self.release()
+
+    def collect_metrics(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["in_flight"] = self.in_flight
+            stats["clients"] = len(self._buckets)
+        return stats
+
+
+def limit_from_env(name: str, rate: float, burst: int, concurrency: int) -> AdmissionLimit:
+    # Значения по умолчанию переопределяются ADMISSION_<NAME>_RATE/_BURST/_CONCURRENCY
+    prefix = f"ADMISSION_{name.upper()}"
+    return AdmissionLimit(
+        name,
+        rate=float(os.getenv(f"{prefix}_RATE", str(rate))),
+        burst=int(os.getenv(f"{prefix}_BURST", str(burst))),
+        concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+    )
+
+
+def collect_metrics() -> dict:
+    stats = {limit.name: limit.collect_metrics() for limit in _limits}
+    stats["mode"] = ADMISSION_MODE
+    return stats
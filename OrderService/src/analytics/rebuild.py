@@ -0,0 +1,27 @@
+# Пересчёт агрегатов продаж и счётчиков статусов по всей истории заказов
+# на всех шардах.
+# Запуск из каталога src:
+#   python -m analytics.rebuild
+from database import create_all_tables
+from sharding import ShardSessions, create_shard_tables
+from analytics.rollups import rebuild
+
+
+def rebuild_all():
+    # Агрегаты у каждого шарда свои и считаются по его заказам
+    sessions = ShardSessions()
+    try:
+        sessions.map(rebuild)
+    finally:
+        sessions.close()
+
+
+def main():
+    create_all_tables()
+    create_shard_tables()
+    rebuild_all()
+    print("Sales rollups rebuilt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# Инкрементальное обновление агрегатов продаж и счётчиков статусов.
+# Вызывается в той же транзакции, что и запись заказа, поэтому агрегаты
+# всегда согласованы с таблицами order/order_dish.
+import random
+
+from sqlalchemy import func, literal, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert
+
+from models import (
+    DishSalesRollup,
+    Order,
+    OrderArchive,
+    OrderDish,
+    OrderDishArchive,
+    OrderStatusCount,
+)
+
+GRANULARITIES = ("hour", "day")
+STATUS_COUNT_SLOTS = 8
+
+
+def record_sales(db, items, at, sign: int = 1):
+    # items — последовательность (dish_id, quantity, price)
+    totals = {}
+    for dish_id, quantity, price in items:
+        units, revenue = totals.get(dish_id, (0, 0))
+        totals[dish_id] = (units + quantity, revenue + quantity * price)
+    if not totals:
+        return
+
+    # Строки отсортированы, чтобы параллельные транзакции брали блокировки
+    # в одном порядке
+    rows = [
+        {
+            "granularity": granularity,
+            "bucket": func.date_trunc(granularity, at),
+            "dish_id": dish_id,
+            "units": sign * units,
+            "revenue": sign * revenue,
+        }
+        for granularity in GRANULARITIES
+        for dish_id, (units, revenue) in sorted(totals.items())
+    ]
+    stmt = insert(DishSalesRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            DishSalesRollup.granularity,
+            DishSalesRollup.bucket,
+            DishSalesRollup.dish_id,
+        ],
+        set_={
+            "units": DishSalesRollup.units + stmt.excluded.units,
+            "revenue": DishSalesRollup.revenue + stmt.excluded.revenue,
+        },
+    )
+    db.execute(stmt)
+
+
+def record_order_sales(db, order_id: int, at, sign: int = 1):
+    items = db.query(OrderDish.dish_id, OrderDish.quantity, OrderDish.price).filter(
+        OrderDish.order_id == order_id,
+    ).all()
+    record_sales(db, items, at, sign)
+
+
+def record_orders_sales(db, order_ids, sign: int = 1, archived: bool = False):
+    # Продажи нескольких заказов сразу: один INSERT ... SELECT на гранулярность.
+    # archived — заказы лежат в архивных таблицах
+    if not order_ids:
+        return
+    orders, order_dishes = (OrderArchive, OrderDishArchive) if archived else (Order, OrderDish)
+    for granularity in GRANULARITIES:
+        bucket = func.date_trunc(granularity, orders.created_at)
+        sales = (
+            select(
+                literal(granularity),
+                bucket,
+                order_dishes.dish_id,
+                sign * func.sum(order_dishes.quantity),
+                sign * func.sum(order_dishes.quantity * order_dishes.price),
+            )
+            .select_from(order_dishes)
+            .join(orders, orders.id == order_dishes.order_id)
+            .where(order_dishes.order_id.in_(sorted(order_ids)))
+            .group_by(bucket, order_dishes.dish_id)
+            .order_by(bucket, order_dishes.dish_id)
+        )
+        stmt = insert(DishSalesRollup).from_select(
+            ["granularity", "bucket", "dish_id", "units", "revenue"],
+            sales,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                DishSalesRollup.granularity,
+                DishSalesRollup.bucket,
+                DishSalesRollup.dish_id,
+            ],
+            set_={
+                "units": DishSalesRollup.units + stmt.excluded.units,
+                "revenue": DishSalesRollup.revenue + stmt.excluded.revenue,
+            },
+        )
+        db.execute(stmt)
+
+
+def record_status_change(db, old_status, new_status):
+    record_status_changes(db, [(old_status, new_status)])
+
+
+def record_status_changes(db, transitions):
+    # transitions — последовательность (старый статус, новый статус)
+    deltas = {}
+    for old_status, new_status in transitions:
+        if old_status == new_status:
+            continue
+        if old_status:
+            deltas[old_status] = deltas.get(old_status, 0) - 1
+        if new_status:
+            deltas[new_status] = deltas.get(new_status, 0) + 1
+    deltas = {status: delta for status, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    slot = random.randrange(STATUS_COUNT_SLOTS)
+    rows = [
+        {"status": status, "slot": slot, "count": delta}
+        for status, delta in sorted(deltas.items())
+    ]
+    stmt = insert(OrderStatusCount).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderStatusCount.status, OrderStatusCount.slot],
+        set_={"count": OrderStatusCount.count + stmt.excluded.count},
+    )
+    db.execute(stmt)
+
+
+def rebuild(db):
+    # SHARE блокирует запись в order и архив на время пересчёта, чтобы не
+    # потерять и не посчитать дважды параллельные изменения
+    db.execute(text('LOCK TABLE "order", order_archive IN SHARE MODE'))
+    db.query(DishSalesRollup).delete(synchronize_session=False)
+    db.query(OrderStatusCount).delete(synchronize_session=False)
+
+    # Архивные заказы тоже входят в историю продаж
+    orders = union_all(
+        select(Order.id, Order.status, Order.created_at),
+        select(OrderArchive.id, OrderArchive.status, OrderArchive.created_at),
+    ).subquery()
+    order_dishes = union_all(
+        select(OrderDish.order_id, OrderDish.dish_id, OrderDish.quantity, OrderDish.price),
+        select(OrderDishArchive.order_id, OrderDishArchive.dish_id, OrderDishArchive.quantity, OrderDishArchive.price),
+    ).subquery()
+
+    for granularity in GRANULARITIES:
+        bucket = func.date_trunc(granularity, orders.c.created_at)
+        sales = (
+            select(
+                literal(granularity),
+                bucket,
+                order_dishes.c.dish_id,
+                func.sum(order_dishes.c.quantity),
+                func.sum(order_dishes.c.quantity * order_dishes.c.price),
+            )
+            .select_from(order_dishes)
+            .join(orders, orders.c.id == order_dishes.c.order_id)
+            .where(orders.c.status != "cancelled")
+            .group_by(bucket, order_dishes.c.dish_id)
+        )
+        db.execute(insert(DishSalesRollup).from_select(
+            ["granularity", "bucket", "dish_id", "units", "revenue"],
+            sales,
+        ))
+
+    counts = select(orders.c.status, literal(0), func.count()).group_by(orders.c.status)
+    db.execute(insert(OrderStatusCount).from_select(["status", "slot", "count"], counts))
+    db.commit()
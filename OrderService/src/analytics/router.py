@@ -0,0 +1,98 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import func
+from datetime import datetime, timedelta
+from typing import Optional
+from models import User, DishSalesRollup, OrderStatusCount
+from orders.router import get_current_user
+from query_budget import query_budget
+from sharding import SHARD_COUNT, ShardSessions, get_read_shards, read_session_factories
+import warmup
+from analytics.schemas import (
+    Granularity,
+    SalesReportResponse,
+    StatusCountsResponse,
+)
+
+router = APIRouter()
+
+
+@router.get("/sales", response_model=SalesReportResponse)
+@query_budget(SHARD_COUNT)
+def get_sales(
+    granularity: Granularity = Granularity.day,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    dish_id: Optional[int] = None,
+    current_user: User = Depends(get_current_user),
+    shards: ShardSessions = Depends(get_read_shards),
+):
+    if current_user.role != "manager":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only managers can view sales analytics",
+        )
+
+    # По умолчанию — последние сутки
+    if end is None:
+        end = datetime.now()
+    if start is None:
+        start = end - timedelta(days=1)
+
+    # Читаем только агрегаты за окно, история заказов не сканируется
+    def shard_sales(db):
+        query = db.query(
+            DishSalesRollup.bucket,
+            DishSalesRollup.dish_id,
+            DishSalesRollup.units,
+            DishSalesRollup.revenue,
+        ).filter(
+            DishSalesRollup.granularity == granularity.value,
+            DishSalesRollup.bucket >= func.date_trunc(granularity.value, start),
+            DishSalesRollup.bucket <= end,
+        )
+        if dish_id is not None:
+            query = query.filter(DishSalesRollup.dish_id == dish_id)
+        return query.all()
+
+    # Агрегаты у каждого шарда свои, складываются по (bucket, dish_id)
+    totals = {}
+    for rows in shards.map(shard_sales):
+        for bucket, row_dish_id, units, revenue in rows:
+            key = (bucket, row_dish_id)
+            total_units, total_revenue = totals.get(key, (0, 0))
+            totals[key] = (total_units + units, total_revenue + revenue)
+    sales = [
+        {"bucket": bucket, "dish_id": row_dish_id, "units": units, "revenue": revenue}
+        for (bucket, row_dish_id), (units, revenue) in sorted(totals.items())
+    ]
+    return {"granularity": granularity, "sales": sales}
+
+
+def shard_status_counts(db) -> list:
+    return db.query(
+        OrderStatusCount.status,
+        func.sum(OrderStatusCount.count),
+    ).group_by(OrderStatusCount.status).all()
+
+
+@router.get("/status-counts", response_model=StatusCountsResponse)
+@query_budget(SHARD_COUNT)
+def get_status_counts(
+    current_user: User = Depends(get_current_user),
+    shards: ShardSessions = Depends(get_read_shards),
+):
+    if current_user.role != "manager":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only managers can view order statistics",
+        )
+
+    counts = {}
+    for rows in shards.map(shard_status_counts):
+        for order_status, count in rows:
+            counts[order_status] = counts.get(order_status, 0) + int(count)
+    return {"counts": counts}
+
+
+for session_factory in read_session_factories():
+    warmup.register(shard_status_counts, session_factory)
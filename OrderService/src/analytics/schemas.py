@@ -0,0 +1,28 @@
+from pydantic import BaseModel
+from decimal import Decimal
+from datetime import datetime
+from enum import Enum
+
+
+class Granularity(str, Enum):
+    hour = "hour"
+    day = "day"
+
+
+class DishSalesResponse(BaseModel):
+    bucket: datetime
+    dish_id: int
+    units: int
+    revenue: Decimal
+
+    class Config:
+        orm_mode = True
+
+
+class SalesReportResponse(BaseModel):
+    granularity: Granularity
+    sales: list[DishSalesResponse]
+
+
+class StatusCountsResponse(BaseModel):
+    counts: dict[str, int]
@@ -0,0 +1,279 @@
+# Клиент AuthService: строгие таймауты, circuit breaker, hedged-запросы
+# и stale-while-revalidate кэш пользователей
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Lock
+
+import requests
+from requests.exceptions import RequestException
+from fastapi import HTTPException, status
+from dotenv import load_dotenv
+
+import metrics
+import tracing
+import warmup
+from models import User
+
+load_dotenv()
+
+AUTH_SERVICE_HOST = os.getenv("AUTH_SERVICE_HOST")
+AUTH_CONNECT_TIMEOUT = float(os.getenv("AUTH_CONNECT_TIMEOUT", "0.5"))
+AUTH_READ_TIMEOUT = float(os.getenv("AUTH_READ_TIMEOUT", "1.0"))
+# Через сколько секунд без ответа отправлять второй запрос; 0 — без hedging
+AUTH_HEDGE_AFTER = float(os.getenv("AUTH_HEDGE_AFTER", "0"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_STALE_TTL = float(os.getenv("AUTH_STALE_TTL", "600"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_BREAKER_FAILURES = int(os.getenv("AUTH_BREAKER_FAILURES", "5"))
+AUTH_BREAKER_RESET = float(os.getenv("AUTH_BREAKER_RESET", "10"))
+
+logger = logging.getLogger(__name__)
+
+
+class AuthServiceError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, max_failures: int, reset_timeout: float):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            # В half_open пропускаем только один пробный запрос
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.max_failures:
+                if self.state != self.OPEN:
+                    _count("breaker_opened")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_session = requests.Session()
+_breaker = CircuitBreaker(AUTH_BREAKER_FAILURES, AUTH_BREAKER_RESET)
+_request_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="auth-request")
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="auth-refresh")
+
+# user_id -> (время получения, данные пользователя)
+_cache = OrderedDict()
+_refreshing = set()
+_cache_lock = Lock()
+
+_stats = {
+    "requests": 0,
+    "failures": 0,
+    "short_circuited": 0,
+    "breaker_opened": 0,
+    "hedges_sent": 0,
+    "hedges_won": 0,
+    "cache_hits": 0,
+    "stale_served": 0,
+    "background_refreshes": 0,
+}
+_stats_lock = Lock()
+
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _fetch_once(user_id: int, headers: dict):
+    _count("requests")
+    url = f"http://{AUTH_SERVICE_HOST}:8000/users/{user_id}"
+    try:
+        response = _session.get(
+            url,
+            headers=headers,
+            timeout=(AUTH_CONNECT_TIMEOUT, AUTH_READ_TIMEOUT),
+        )
+    except Exception as e:
+        # RequestException и то, что requests не обернул: любая ошибка
+        # вызова — это недоступный AuthService (503), а не 500
+        _count("failures")
+        raise AuthServiceError(str(e))
+
+    if response.status_code >= 500:
+        _count("failures")
+        raise AuthServiceError(f"AuthService responded with {response.status_code}")
+    if response.status_code != 200:
+        return None
+    try:
+        user_data = response.json()
+    except ValueError as e:
+        _count("failures")
+        raise AuthServiceError(f"AuthService returned invalid JSON: {e}")
+    if not isinstance(user_data, dict):
+        _count("failures")
+        raise AuthServiceError("AuthService returned an unexpected response")
+    return user_data
+
+
+def _fetch(user_id: int, headers: dict):
+    if AUTH_HEDGE_AFTER <= 0:
+        return _fetch_once(user_id, headers)
+
+    first = _request_executor.submit(_fetch_once, user_id, headers)
+    done, _ = wait([first], timeout=AUTH_HEDGE_AFTER)
+    if done:
+        return first.result()
+
+    _count("hedges_sent")
+    span = tracing.current_span()
+    if span is not None:
+        span.attributes["auth.hedged"] = True
+    second = _request_executor.submit(_fetch_once, user_id, headers)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except AuthServiceError as e:
+                error = e
+                continue
+            if future is second:
+                _count("hedges_won")
+            return result
+    raise error
+
+
+def _load(user_id: int):
+    if not _breaker.allow_request():
+        _count("short_circuited")
+        raise AuthServiceError("Circuit breaker is open")
+
+    try:
+        with tracing.start_span(
+            "GET /users/{user_id}",
+            {"peer.service": "auth-service", "user_id": user_id},
+            tracing.SPAN_KIND_CLIENT,
+        ):
+            # Потоки пула не видят контекст трассировки, заголовок готовим здесь
+            user_data = _fetch(user_id, tracing.inject_headers())
+    except Exception:
+        # Любая ошибка, а не только AuthServiceError: иначе пробный запрос
+        # half_open так и остался бы «в полёте», и breaker не закрылся бы
+        _breaker.record_failure()
+        raise
+    _breaker.record_success()
+
+    with _cache_lock:
+        if user_data is None:
+            _cache.pop(user_id, None)
+        else:
+            _cache[user_id] = (time.monotonic(), user_data)
+            _cache.move_to_end(user_id)
+            while len(_cache) > AUTH_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return user_data
+
+
+def _refresh(user_id: int):
+    try:
+        _count("background_refreshes")
+        _load(user_id)
+    except AuthServiceError as e:
+        logger.warning("Background refresh of user %s failed: %s", user_id, e)
+    finally:
+        with _cache_lock:
+            _refreshing.discard(user_id)
+
+
+def _refresh_in_background(user_id: int):
+    with _cache_lock:
+        if user_id in _refreshing:
+            return
+        _refreshing.add(user_id)
+    _refresh_executor.submit(_refresh, user_id)
+
+
+def get_user_by_id(user_id: int) -> User:
+    with _cache_lock:
+        entry = _cache.get(user_id)
+        if entry is not None:
+            _cache.move_to_end(user_id)
+
+    if entry is not None:
+        fetched_at, user_data = entry
+        age = time.monotonic() - fetched_at
+        if age < AUTH_CACHE_TTL:
+            _count("cache_hits")
+            return User(**user_data)
+        if age < AUTH_STALE_TTL:
+            _count("stale_served")
+            _refresh_in_background(user_id)
+            return User(**user_data)
+
+    try:
+        user_data = _load(user_id)
+    except AuthServiceError as e:
+        logger.warning("Failed to fetch user %s from AuthService: %s", user_id, e)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Auth service is unavailable",
+        )
+
+    if user_data is None:
+        return None
+    return User(**user_data)
+
+
+def warm_connection():
+    # Соединение с AuthService открывается заранее; его недоступность не
+    # мешает готовности — на этот случай есть breaker и кэш
+    try:
+        _session.get(
+            f"http://{AUTH_SERVICE_HOST}:8000/ready",
+            timeout=(AUTH_CONNECT_TIMEOUT, AUTH_READ_TIMEOUT),
+        )
+    except RequestException as e:
+        logger.warning("AuthService is not reachable during warm-up: %s", e)
+
+
+def _collect_metrics() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["breaker_state"] = _breaker.state
+    stats["breaker_failures"] = _breaker.failures
+    stats["cache_size"] = len(_cache)
+    return stats
+
+
+metrics.register("auth_client", _collect_metrics)
+warmup.register(warm_connection)
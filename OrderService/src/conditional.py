@@ -0,0 +1,61 @@
+# Условные GET для больших списков. Версия списка — число строк, наибольший
+# updated_at и сумма updated_at в микросекундах: вставка и удаление меняют
+# число, изменение строки — сумму, даже если её новый updated_at не больше
+# максимума (транзакции коммитятся не в порядке now()). Сумма целочисленная:
+# до Postgres 14 extract возвращает double, и в сумме миллионов отметок
+# сдвиг одной строки на микросекунды теряется. Совпавший If-None-Match
+# получает 304 до загрузки и сериализации строк. If-Modified-Since не
+# проверяется: удаление строки не сдвигает max(updated_at), и по одной дате
+# клиент остался бы со старым списком.
+import hashlib
+from datetime import timezone
+from email.utils import format_datetime
+from typing import Optional
+
+from fastapi import Request, Response, status
+from sqlalchemy import BigInteger, cast, func
+
+
+def version_columns(updated_at) -> tuple:
+    # Выражения для SELECT: число строк, max(updated_at), сумма updated_at.
+    # sum(bigint) в Postgres — numeric, без переполнения и округления
+    microseconds = cast(func.floor(func.extract("epoch", updated_at) * 1000000), BigInteger)
+    return func.count(), func.max(updated_at), func.sum(microseconds)
+
+
+def list_etag(count: int, last_modified, checksum) -> str:
+    version = last_modified.timestamp() if last_modified else 0
+    digest = hashlib.sha1(f"{version}|{checksum}".encode()).hexdigest()[:16]
+    # Слабый: тело может прийти сжатым по-разному
+    return f'W/"{count:x}-{digest}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def conditional_list(request: Request, response: Response, versions) -> Optional[Response]:
+    # versions — строки version_columns по таблицам и шардам.
+    # Ставит ETag и Last-Modified; возвращает ответ 304, если список у клиента
+    # не изменился, иначе None
+    versions = list(versions)
+    count = sum(rows for rows, _, _ in versions)
+    last_modified = max((updated_at for _, updated_at, _ in versions if updated_at is not None), default=None)
+    checksum = sum(total for _, _, total in versions if total is not None)
+
+    headers = {
+        "ETag": list_etag(count, last_modified, checksum),
+        # Списки зависят от пользователя, и их надо перепроверять каждый раз
+        "Cache-Control": "private, no-cache",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -1,5 +1,6 @@
 # Всё, что связано с подключением к базе данных
 import os
+from fastapi import Request, Response
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
@@ -13,20 +14,54 @@ DB_NAME = os.getenv("DB_NAME")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 
+# Необязательная реплика для читающих обработчиков
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+# Сколько секунд после записи клиент читает с primary (read-your-writes)
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", "5"))
+# Срок задаёт max_age куки, значение не важно
+STICKY_COOKIE = "db_read_primary"
+
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
 engine = create_engine(DATABASE_URL)
 
+if DB_REPLICA_HOST:
+    REPLICA_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_REPLICA_HOST}:{DB_REPLICA_PORT}/{DB_NAME}"
+    replica_engine = create_engine(REPLICA_DATABASE_URL)
+else:
+    replica_engine = engine
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
 
 Base = declarative_base()
 
 def create_all_tables():
     Base.metadata.create_all(bind=engine)
 
-def get_db():
+def get_db(request: Request, response: Response):
+    # После записи клиент какое-то время читает с primary, чтобы не увидеть
+    # устаревшие данные из отстающей реплики
+    if request.method not in ("GET", "HEAD") and replica_engine is not engine:
+        response.set_cookie(
+            STICKY_COOKIE,
+            "1",
+            max_age=REPLICA_STICKY_SECONDS,
+            httponly=True,
+        )
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+def get_read_db(request: Request):
+    if STICKY_COOKIE in request.cookies:
+        db = SessionLocal()
+    else:
+        db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
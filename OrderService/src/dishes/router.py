@@ -1,26 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi import status
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
-from database import get_db
+from database import ReplicaSessionLocal, get_db, get_read_db
 from models import Dish, User
+from auth_client import get_user_by_id
+import tracing
+from query_budget import query_budget
+from conditional import conditional_list, version_columns
+import warmup
 from dishes.schemas import (
     DishCreateRequest,
     DishUpdateRequest,
     DishInfoResponse,
     DishListResponse,
+    DishSearchResponse,
     DishErrorResponse,
 )
-import requests
-from requests.exceptions import RequestException
+from dishes.search import search_dishes, clear_cache
 import jwt
+from jwt.exceptions import ExpiredSignatureError, PyJWTError
 from dotenv import load_dotenv
 import os
 
 router = APIRouter()
 
-AUTH_SERVICE_HOST = os.getenv("AUTH_SERVICE_HOST")
-
 load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET")
 if JWT_SECRET is None:
@@ -28,31 +32,10 @@ if JWT_SECRET is None:
 
 security = HTTPBearer()
 
-def get_user_by_id(user_id: int) -> User:
-    try:
-        url = f"http://{AUTH_SERVICE_HOST}:8000/users/{user_id}"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            user = User(**user_data)
-            return user
-        else:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail="Failed to fetch user data",
-            )
-    except RequestException as e:
-        print(f"An error occurred during the request: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
-
-
 def get_current_user(token: str = Depends(security), db: Session = Depends(get_db)):
     try:
-        payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
+        with tracing.start_span("jwt.decode"):
+            payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
     except ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -81,11 +64,24 @@ def get_current_user(token: str = Depends(security), db: Session = Depends(get_d
     return user
 
 @router.get("/menu", response_model=DishListResponse)
-def get_menu(db: Session = Depends(get_db)):
+@query_budget(1)
+def get_menu(db: Session = Depends(get_read_db)):
     dishes = db.query(Dish).filter(Dish.quantity > 0).all()
     return {"dishes": dishes}
 
+@router.get("/search", response_model=DishSearchResponse)
+@query_budget(1)
+def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db),
+):
+    dishes = search_dishes(db, q, limit, offset)
+    return {"query": q, "limit": limit, "offset": offset, "dishes": dishes}
+
 @router.post("", response_model=DishInfoResponse, status_code=status.HTTP_201_CREATED)
+@query_budget(3)
 def create_dish(
     dish_data: DishCreateRequest,
     db: Session = Depends(get_db),
@@ -108,9 +104,11 @@ def create_dish(
     db.add(dish)
     db.commit()
     db.refresh(dish)
+    clear_cache()
     return dish
 
 @router.put("/{dish_id}", response_model=DishInfoResponse)
+@query_budget(3)
 def update_dish(
     dish_id: int,
     dish_data: DishUpdateRequest,
@@ -134,11 +132,15 @@ def update_dish(
         setattr(dish, field, value)
     db.commit()
     db.refresh(dish)
+    clear_cache()
     return dish
 
 @router.get("", response_model=DishListResponse)
+@query_budget(2)
 def get_all_dishes(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     if current_user.role != "manager":
@@ -147,13 +149,20 @@ def get_all_dishes(
             detail="Only managers can get all dishes"
         )
 
+    not_modified = conditional_list(request, response, [
+        db.query(*version_columns(Dish.updated_at)).one(),
+    ])
+    if not_modified:
+        return not_modified
+
     dishes = db.query(Dish).all()
     return {"dishes": dishes}
 
 @router.get("/{dish_id}", response_model=DishInfoResponse)
+@query_budget(1)
 def get_dish(
     dish_id: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_user),
 ):
     if current_user.role != "manager":
@@ -172,6 +181,7 @@ def get_dish(
     return dish
 
 @router.delete("/{dish_id}", response_model=DishErrorResponse)
+@query_budget(2)
 def delete_dish(
     dish_id: int,
     db: Session = Depends(get_db),
@@ -191,4 +201,15 @@ def delete_dish(
         )
     db.delete(dish)
     db.commit()
+    clear_cache()
     return {"error": "Dish deleted"}
+
+
+def warm_queries(db: Session):
+    # Те же формы запросов, что у читающих обработчиков выше
+    db.query(Dish).filter(Dish.quantity > 2**31 - 1).all()
+    db.query(*version_columns(Dish.updated_at)).one()
+    db.query(Dish).get(0)
+
+
+warmup.register(warm_queries, ReplicaSessionLocal)
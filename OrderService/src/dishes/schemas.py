@@ -7,6 +7,7 @@ class DishCreateRequest(BaseModel):
     description: constr(max_length=255) = ""
     price: Decimal = Field(..., ge=0)
     quantity: conint(ge=0)
+    prep_time: conint(ge=0) = 300
 
 
 class DishUpdateRequest(BaseModel):
@@ -14,6 +15,7 @@ class DishUpdateRequest(BaseModel):
     description: constr(max_length=255) = ""
     price: Decimal = Field(..., ge=0)
     quantity: conint(ge=0)
+    prep_time: conint(ge=0) = 300
 
 
 class DishInfoResponse(BaseModel):
@@ -22,6 +24,7 @@ class DishInfoResponse(BaseModel):
     description: str
     price: Decimal
     quantity: int
+    prep_time: int
 
     class Config:
         orm_mode = True
@@ -31,5 +34,12 @@ class DishListResponse(BaseModel):
     dishes: list[DishInfoResponse]
 
 
+class DishSearchResponse(BaseModel):
+    query: str
+    limit: int
+    offset: int
+    dishes: list[DishInfoResponse]
+
+
 class DishErrorResponse(BaseModel):
     error: str
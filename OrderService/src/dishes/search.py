@@ -0,0 +1,156 @@
+# Нечёткий поиск блюд по названию и описанию (pg_trgm) с кэшем частых запросов.
+# План и время запроса без кэша, из каталога src (например, после
+# seed.py --dishes 50000):
+#   python -m dishes.search борщ "куриный суп" --runs 200
+import argparse
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import func, or_
+
+import metrics
+from database import SessionLocal
+from models import Dish
+from dishes.schemas import DishInfoResponse
+
+DISH_SEARCH_CACHE_TTL = float(os.getenv("DISH_SEARCH_CACHE_TTL", "5"))
+DISH_SEARCH_CACHE_SIZE = int(os.getenv("DISH_SEARCH_CACHE_SIZE", "1024"))
+
+# Запросы короче ищутся только по префиксу названия: триграммы 1–2 символов
+# почти не сужают выборку, и similarity() считалась бы по большей части каталога
+MIN_FUZZY_QUERY_LENGTH = 3
+
+# (запрос, limit, offset) -> (время, результат)
+_cache = OrderedDict()
+_lock = Lock()
+_stats = {"hits": 0, "misses": 0}
+
+
+def normalize_query(q: str) -> str:
+    return " ".join(q.lower().split())
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _cache_get(key):
+    with _lock:
+        entry = _cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > DISH_SEARCH_CACHE_TTL:
+            _stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        _stats["hits"] += 1
+        return entry[1]
+
+
+def _cache_put(key, value):
+    with _lock:
+        _cache[key] = (time.monotonic(), value)
+        _cache.move_to_end(key)
+        while len(_cache) > DISH_SEARCH_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+
+def search_query(db, q: str, limit: int, offset: int):
+    # q уже нормализован
+    if len(q) < MIN_FUZZY_QUERY_LENGTH:
+        # Индекс ix_dish_name_prefix отдаёт строки сразу в нужном порядке
+        name = func.lower(Dish.name).collate("C")
+        return (
+            db.query(Dish)
+            .filter(Dish.quantity > 0, name.like(_escape_like(q) + "%"))
+            .order_by(name, Dish.id)
+            .offset(offset)
+            .limit(limit)
+        )
+
+    description = func.coalesce(Dish.description, "")
+    # Все три условия обслуживаются триграммными индексами:
+    # префикс по названию, похожее название, похожее слово в описании
+    rank = func.greatest(
+        func.similarity(Dish.name, q),
+        func.word_similarity(q, description),
+    )
+    return (
+        db.query(Dish)
+        .filter(
+            Dish.quantity > 0,
+            or_(
+                Dish.name.ilike(_escape_like(q) + "%"),
+                Dish.name.op("%")(q),
+                Dish.description.op("%>")(q),
+            ),
+        )
+        .order_by(rank.desc(), Dish.id)
+        .offset(offset)
+        .limit(limit)
+    )
+
+
+def search_dishes(db, q: str, limit: int, offset: int) -> list:
+    q = normalize_query(q)
+    key = (q, limit, offset)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    dishes = search_query(db, q, limit, offset).all()
+    result = [DishInfoResponse.from_orm(dish).dict() for dish in dishes]
+    _cache_put(key, result)
+    return result
+
+
+def _collect_metrics() -> dict:
+    with _lock:
+        stats = dict(_stats)
+        stats["cache_size"] = len(_cache)
+    return stats
+
+
+metrics.register("dish_search", _collect_metrics)
+
+
+def percentile(durations: list, fraction: float) -> float:
+    durations = sorted(durations)
+    return durations[min(len(durations) - 1, int(len(durations) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the plan and timings of the dish search query")
+    parser.add_argument("queries", nargs="+")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        for q in map(normalize_query, args.queries):
+            statement = search_query(db, q, args.limit, 0).statement.compile(dialect=db.get_bind().dialect)
+            plan = db.connection().exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", statement.params)
+            print(f"-- {q}")
+            print("\n".join(row[0] for row in plan))
+
+            # Как обработчик GET /dishes/search при промахе кэша
+            durations = []
+            for _ in range(args.runs):
+                clear_cache()
+                started = time.perf_counter()
+                search_dishes(db, q, args.limit, 0)
+                durations.append((time.perf_counter() - started) * 1000)
+            print(f"p50 {percentile(durations, 0.5):.2f} ms, p99 {percentile(durations, 0.99):.2f} ms, runs {args.runs}\n")
+            db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
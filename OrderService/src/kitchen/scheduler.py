@@ -0,0 +1,146 @@
+# Планировщик кухни: ограниченное число поваров (слотов) и очередь с приоритетом.
+# Не зависит от базы данных и реального времени, поэтому используется
+# и в рабочем цикле сервиса, и в офлайн-симуляции (kitchen/simulation.py).
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+def fifo_priority(duration: float, enqueued_at: float, aging_rate: float) -> float:
+    return enqueued_at
+
+
+def sjf_priority(duration: float, enqueued_at: float, aging_rate: float) -> float:
+    # Короткие заказы вперёд, но каждая секунда ожидания уменьшает приоритет
+    # на aging_rate. Слагаемое -aging_rate * now общее для всех заказов в
+    # очереди, поэтому ключ кучи от текущего времени не зависит.
+    return duration + aging_rate * enqueued_at
+
+
+POLICIES = {
+    "fifo": fifo_priority,
+    "sjf": sjf_priority,
+}
+
+
+class KitchenJob:
+    __slots__ = ("order_id", "duration", "enqueued_at", "started_at", "finish_at")
+
+    def __init__(self, order_id: int, duration: float, enqueued_at: float):
+        self.order_id = order_id
+        self.duration = duration
+        self.enqueued_at = enqueued_at
+        self.started_at = None
+        self.finish_at = None
+
+
+class KitchenScheduler:
+    def __init__(
+        self,
+        chef_slots: int,
+        policy: str = "fifo",
+        aging_rate: float = 1.0,
+        clock=time.time,
+        throughput_window: float = 60.0,
+    ):
+        if chef_slots < 1:
+            raise ValueError("chef_slots must be at least 1")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy: {policy}")
+        self.chef_slots = chef_slots
+        self.policy = policy
+        self.aging_rate = aging_rate
+        self.clock = clock
+        self.throughput_window = throughput_window
+
+        self._priority = POLICIES[policy]
+        self._queue = []
+        self._running = []
+        self._sequence = itertools.count()
+        self._known = set()
+
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent_completions = deque()
+
+    def __contains__(self, order_id: int) -> bool:
+        return order_id in self._known
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    @property
+    def busy_slots(self) -> int:
+        return len(self._running)
+
+    def submit(self, order_id: int, duration: float, enqueued_at: float = None):
+        if order_id in self._known:
+            return
+        if enqueued_at is None:
+            enqueued_at = self.clock()
+        job = KitchenJob(order_id, duration, enqueued_at)
+        key = self._priority(duration, enqueued_at, self.aging_rate)
+        heapq.heappush(self._queue, (key, next(self._sequence), job))
+        self._known.add(order_id)
+
+    def start_ready(self) -> list:
+        now = self.clock()
+        started = []
+        while self._queue and len(self._running) < self.chef_slots:
+            _, _, job = heapq.heappop(self._queue)
+            job.started_at = now
+            job.finish_at = now + job.duration
+            heapq.heappush(self._running, (job.finish_at, next(self._sequence), job))
+            started.append(job)
+
+            wait = now - job.enqueued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return started
+
+    def complete_due(self) -> list:
+        now = self.clock()
+        completed = []
+        while self._running and self._running[0][0] <= now:
+            _, _, job = heapq.heappop(self._running)
+            self._known.discard(job.order_id)
+            self._recent_completions.append(now)
+            completed.append(job)
+        self.completed += len(completed)
+        return completed
+
+    def release(self, job: KitchenJob):
+        # Заказ отменили до начала готовки: освобождаем слот повара
+        self._running = [entry for entry in self._running if entry[2] is not job]
+        heapq.heapify(self._running)
+        self._known.discard(job.order_id)
+
+    def next_event_time(self):
+        if self._running:
+            return self._running[0][0]
+        return None
+
+    def stats(self) -> dict:
+        now = self.clock()
+        while self._recent_completions and self._recent_completions[0] < now - self.throughput_window:
+            self._recent_completions.popleft()
+        started = self.completed + len(self._running)
+        # Снимок очереди: stats() вызывается из потоков обработчиков /metrics
+        queue = list(self._queue)
+        oldest_wait = 0.0
+        if queue:
+            oldest_wait = now - min(job.enqueued_at for _, _, job in queue)
+        return {
+            "policy": self.policy,
+            "chef_slots": self.chef_slots,
+            "busy_slots": self.busy_slots,
+            "queue_depth": len(queue),
+            "oldest_wait": oldest_wait,
+            "avg_wait": self.total_wait / started if started else 0.0,
+            "max_wait": self.max_wait,
+            "completed": self.completed,
+            "throughput_per_minute": len(self._recent_completions) * 60.0 / self.throughput_window,
+        }
@@ -0,0 +1,103 @@
+# Офлайн-сравнение политик планировщика на синтетическом потоке заказов.
+# Запуск из каталога src:
+#   python -m kitchen.simulation --orders 2000 --rate 0.008 --slots 4 --seed 42
+import argparse
+import random
+
+from kitchen.scheduler import POLICIES, KitchenScheduler
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def generate_orders(count: int, rate: float, dishes: int, max_items: int, seed: int) -> list:
+    # Поток Пуассона с интенсивностью rate заказов в секунду. Время готовки
+    # блюд логнормальное, популярность блюд по закону Ципфа.
+    rng = random.Random(seed)
+    prep_times = [round(rng.lognormvariate(4.8, 0.6)) for _ in range(dishes)]
+    weights = [1.0 / (rank + 1) for rank in range(dishes)]
+
+    orders = []
+    now = 0.0
+    for order_id in range(1, count + 1):
+        now += rng.expovariate(rate)
+        items = rng.randint(1, max_items)
+        chosen = rng.choices(range(dishes), weights=weights, k=items)
+        duration = sum(prep_times[dish] for dish in chosen)
+        orders.append((order_id, now, duration))
+    return orders
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def simulate(orders: list, chef_slots: int, policy: str, aging_rate: float) -> dict:
+    clock = VirtualClock()
+    scheduler = KitchenScheduler(chef_slots, policy=policy, aging_rate=aging_rate, clock=clock)
+    waits = []
+    turnarounds = []
+    arrivals = iter(orders)
+    next_arrival = next(arrivals, None)
+
+    while next_arrival is not None or scheduler.queue_depth or scheduler.busy_slots:
+        next_finish = scheduler.next_event_time()
+        if next_arrival is not None and (next_finish is None or next_arrival[1] <= next_finish):
+            order_id, arrived_at, duration = next_arrival
+            clock.now = arrived_at
+            scheduler.submit(order_id, duration, enqueued_at=arrived_at)
+            next_arrival = next(arrivals, None)
+        else:
+            clock.now = next_finish
+            for job in scheduler.complete_due():
+                turnarounds.append(job.finish_at - job.enqueued_at)
+        for job in scheduler.start_ready():
+            waits.append(job.started_at - job.enqueued_at)
+
+    makespan = clock.now
+    return {
+        "policy": policy,
+        "orders": len(orders),
+        "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+        "p50_wait": percentile(waits, 0.50),
+        "p95_wait": percentile(waits, 0.95),
+        "max_wait": max(waits) if waits else 0.0,
+        "mean_turnaround": sum(turnarounds) / len(turnarounds) if turnarounds else 0.0,
+        "throughput_per_hour": len(orders) * 3600.0 / makespan if makespan else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare kitchen scheduling policies on a synthetic order stream")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=0.008, help="Orders per second")
+    parser.add_argument("--slots", type=int, default=4, help="Number of chef slots")
+    parser.add_argument("--dishes", type=int, default=40)
+    parser.add_argument("--max-items", type=int, default=4)
+    parser.add_argument("--aging-rate", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--policies", nargs="+", default=sorted(POLICIES), choices=sorted(POLICIES))
+    args = parser.parse_args()
+
+    orders = generate_orders(args.orders, args.rate, args.dishes, args.max_items, args.seed)
+    columns = ["policy", "mean_wait", "p50_wait", "p95_wait", "max_wait", "mean_turnaround", "throughput_per_hour"]
+    print(" ".join(f"{column:>18}" for column in columns))
+    for policy in args.policies:
+        result = simulate(orders, args.slots, policy, args.aging_rate)
+        print(" ".join(
+            f"{result[column]:>18}" if isinstance(result[column], str) else f"{result[column]:>18.1f}"
+            for column in columns
+        ))
+
+
+if __name__ == "__main__":
+    main()
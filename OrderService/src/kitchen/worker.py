@@ -0,0 +1,152 @@
+# Рабочий цикл кухни: забирает новые заказы из базы, отдаёт их свободным
+# поварам через планировщик и отмечает готовые заказы
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from database import SessionLocal
+from models import DEFAULT_PREP_TIME, Dish, Order, OrderDish
+from sharding import SHARD_COUNT, ShardSessions, guess_order_shard
+from kitchen.scheduler import KitchenScheduler
+from analytics.rollups import record_status_change
+from orders.events import hub
+from orders.active import active_orders
+
+KITCHEN_CHEF_SLOTS = int(os.getenv("KITCHEN_CHEF_SLOTS", "4"))
+KITCHEN_POLICY = os.getenv("KITCHEN_POLICY", "fifo")
+KITCHEN_AGING_RATE = float(os.getenv("KITCHEN_AGING_RATE", "1.0"))
+KITCHEN_POLL_INTERVAL = float(os.getenv("KITCHEN_POLL_INTERVAL", "1.0"))
+
+logger = logging.getLogger(__name__)
+
+scheduler = KitchenScheduler(
+    KITCHEN_CHEF_SLOTS,
+    policy=KITCHEN_POLICY,
+    aging_rate=KITCHEN_AGING_RATE,
+)
+metrics.register("kitchen", scheduler.stats)
+
+
+def fetch_shard_orders(db, statuses: tuple) -> list:
+    return (
+        db.query(Order.id, Order.created_at, OrderDish.dish_id, OrderDish.quantity)
+        .outerjoin(OrderDish, OrderDish.order_id == Order.id)
+        .filter(Order.status.in_(statuses))
+        .order_by(Order.id)
+        .all()
+    )
+
+
+def fetch_orders(db, sessions: ShardSessions, statuses: tuple) -> list:
+    # Заказы и позиции — с шардов, время готовки блюд — из каталога.
+    # Длительность заказа — сумма времени готовки всех его позиций.
+    orders = {}
+    for rows in sessions.map(fetch_shard_orders, None, [statuses] * SHARD_COUNT):
+        for order_id, created_at, dish_id, quantity in rows:
+            order = orders.setdefault(order_id, (created_at, []))
+            if dish_id is not None:
+                order[1].append((dish_id, quantity))
+
+    dish_ids = {dish_id for _, items in orders.values() for dish_id, _ in items}
+    prep_times = dict(
+        db.query(Dish.id, Dish.prep_time).filter(Dish.id.in_(dish_ids)).all()
+    ) if dish_ids else {}
+    return [
+        (
+            order_id,
+            created_at,
+            sum(prep_times.get(dish_id, DEFAULT_PREP_TIME) * quantity for dish_id, quantity in items)
+            if items else DEFAULT_PREP_TIME,
+        )
+        for order_id, (created_at, items) in sorted(orders.items())
+    ]
+
+
+def set_status(db, order_id: int, from_statuses: tuple, to_status: str) -> bool:
+    # Условное обновление: заказ могли отменить или закрыть вручную.
+    # Статусы перебираются по одному, чтобы знать прежний для счётчиков.
+    for from_status in from_statuses:
+        updated = db.query(Order).filter(
+            Order.id == order_id,
+            Order.status == from_status,
+        ).update({Order.status: to_status}, synchronize_session=False)
+        if updated:
+            record_status_change(db, from_status, to_status)
+            return True
+    return False
+
+
+def set_shard_status(sessions: ShardSessions, order_id: int, from_statuses: tuple, to_status: str) -> bool:
+    # Сначала шард, где заказ создан; перенесённый заказ найдётся на другом
+    home = guess_order_shard(order_id)
+    for shard in [home] + [shard for shard in range(SHARD_COUNT) if shard != home]:
+        if set_status(sessions[shard], order_id, from_statuses, to_status):
+            return True
+    return False
+
+
+def run_once() -> tuple:
+    db = SessionLocal()
+    sessions = ShardSessions(db)
+    started_jobs = []
+    try:
+        # Каждый проход смотрит и in_progress: заказ могли перевести в работу
+        # вручную (PUT /orders/{id}/status) или он прерван рестартом
+        for order_id, created_at, duration in fetch_orders(db, sessions, ("pending", "in_progress")):
+            if order_id not in scheduler:
+                enqueued_at = created_at.timestamp() if created_at else None
+                scheduler.submit(order_id, float(duration), enqueued_at)
+
+        completed = [
+            job.order_id
+            for job in scheduler.complete_due()
+            if set_shard_status(sessions, job.order_id, ("in_progress",), "completed")
+        ]
+
+        started = []
+        jobs = scheduler.start_ready()
+        while jobs:
+            for job in jobs:
+                if set_shard_status(sessions, job.order_id, ("pending", "in_progress"), "in_progress"):
+                    started.append(job.order_id)
+                    started_jobs.append(job)
+                else:
+                    scheduler.release(job)
+            jobs = scheduler.start_ready()
+
+        sessions.commit()
+        db.commit()
+    except Exception:
+        # Начало готовки откатилось: заказ в базе остался pending, снимаем
+        # его с повара, и следующий проход поставит его в очередь заново
+        for job in started_jobs:
+            scheduler.release(job)
+        raise
+    finally:
+        sessions.close()
+        db.close()
+    return started, completed
+
+
+async def run_kitchen():
+    while True:
+        try:
+            # Запросы к базе синхронные, выполняем их вне цикла событий
+            started, completed = await asyncio.get_running_loop().run_in_executor(None, run_once)
+        except Exception:
+            logger.exception("Kitchen scheduler iteration failed")
+        else:
+            for order_id in completed:
+                active_orders.set_status(order_id, "completed")
+                hub.publish(order_id, "completed")
+            for order_id in started:
+                active_orders.set_status(order_id, "in_progress")
+                hub.publish(order_id, "in_progress")
+
+        delay = KITCHEN_POLL_INTERVAL
+        next_finish = scheduler.next_event_time()
+        if next_finish is not None:
+            delay = max(0.0, min(delay, next_finish - time.time()))
+        await asyncio.sleep(delay)
@@ -1,43 +1,68 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, status
 from database import create_all_tables, get_db
-import dishes.router, orders.router
-from models import Order
-import random
-from datetime import datetime, timedelta
+import database
+import sharding
+import tracing
+import query_budget
+import dishes.router, orders.router, analytics.router
+import metrics
+import admission
+import compression
+import warmup
+from orders.events import hub
+from kitchen.worker import run_kitchen
+from orders.archive import run_archiver
+from orders.active import run_active_orders_sync
 import asyncio
 
 app = FastAPI()
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
+engines = {database.engine, database.replica_engine} | {shard_engine for _, shard_engine, _ in sharding.shards}
+for traced_engine in engines:
+    tracing.instrument_engine(traced_engine)
+    query_budget.instrument_engine(traced_engine)
+shard_session_factories = {session_factory for _, _, session_factory in sharding.shards}
+for session_factory in {database.SessionLocal, database.ReplicaSessionLocal} | shard_session_factories:
+    tracing.instrument_sessions(session_factory)
 
 create_all_tables()
+sharding.create_shard_tables()
 
 app.include_router(dishes.router.router, prefix="/dishes", tags=["dishes"])
 app.include_router(orders.router.router, prefix="/orders", tags=["orders"])
+app.include_router(analytics.router.router, prefix="/analytics", tags=["analytics"])
 
-async def process_orders():
-    while True:
-        db = next(get_db())
-        pending_orders = db.query(Order).filter(Order.status == 'pending').all()
-
-        for order in pending_orders:
-            order.status = 'in_progress'
-            db.add(order)
-        
-        db.commit()
-
-        await asyncio.sleep(random.randint(3, 5))
+metrics.register("tracing", tracing.collect_metrics)
+metrics.register("admission", admission.collect_metrics)
+metrics.register("compression", compression.collect_metrics)
+metrics.register("warmup", warmup.collect_metrics)
 
-        in_progress_orders = db.query(Order).filter(Order.status == 'in_progress').all()
-        for order in in_progress_orders:
-            order.status = 'completed'
-            db.add(order)
-        
-        db.commit()
+@app.get("/metrics", tags=["metrics"])
+@query_budget.query_budget(0)
+def get_metrics():
+    return metrics.snapshot()
 
-        await asyncio.sleep(30)
+@app.get("/ready", tags=["metrics"])
+@query_budget.query_budget(0)
+def get_ready():
+    # Для readiness-проверки балансировщика: трафик — только после прогрева
+    if not warmup.is_ready():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Warming up",
+        )
+    return {"status": "ready"}
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(process_orders())
+    hub.bind(asyncio.get_running_loop())
+    asyncio.create_task(warmup.run_warmup(app, engines))
+    asyncio.create_task(run_active_orders_sync())
+    asyncio.create_task(run_kitchen())
+    asyncio.create_task(run_archiver())
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,9 +1,13 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, CheckConstraint
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, CheckConstraint, Index, DDL, event, inspect, text
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.types import Text, DECIMAL
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
 
+# Время приготовления блюда по умолчанию, секунды
+DEFAULT_PREP_TIME = 300
+
 class User(Base):
     __tablename__ = 'user'
 
@@ -20,7 +24,6 @@ class User(Base):
     )
 
     session = relationship("Session", back_populates="user")
-    orders = relationship("Order", back_populates="user")  # Обратная связь с заказами
 
 class Session(Base):
     __tablename__ = "session"
@@ -40,32 +43,150 @@ class Dish(Base):
     description = Column(Text)
     price = Column(DECIMAL(10, 2), nullable=False)
     quantity = Column(Integer, nullable=False)
+    prep_time = Column(Integer, nullable=False, default=DEFAULT_PREP_TIME, server_default=str(DEFAULT_PREP_TIME))
+    # Версия списка блюд для ETag (GET /dishes)
+    updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
+
+    __table_args__ = (
+        # Проверка дубликатов при создании блюда
+        Index('ix_dish_name', 'name'),
+        # Триграммные индексы для нечёткого поиска (GET /dishes/search)
+        Index('ix_dish_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        Index('ix_dish_description_trgm', 'description', postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'}),
+        # Короткие запросы поиска: префикс названия по btree, в порядке индекса
+        Index('ix_dish_name_prefix', func.lower(name).collate('C')),
+    )
+
+# Расширение нужно до создания триграммных индексов
+event.listen(Base.metadata, 'before_create', DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+
+# Заказы, позиции, их архив и агрегаты продаж могут лежать на шардах
+# (см. sharding.py), поэтому внешних ключей на user и dish у них нет
 
 class Order(Base):
     __tablename__ = 'order'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('user.id'), nullable=False)
+    user_id = Column(Integer, nullable=False)
     status = Column(String(30), nullable=False)
     special_requests = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now(), server_default=func.now())
 
-    user = relationship("User", back_populates="orders")
-    order_dishes = relationship("OrderDish", back_populates="order")
+    order_dishes = relationship("OrderDish", back_populates="order", cascade="all, delete-orphan")
 
     __table_args__ = (
         CheckConstraint("status IN ('pending', 'in_progress', 'completed', 'cancelled')"),
+        Index('ix_order_created_at', 'created_at'),
+        # Кухня постоянно выбирает незакрытые заказы
+        Index('ix_order_open_status', 'status', postgresql_where=status.in_(('pending', 'in_progress'))),
     )
 
 class OrderDish(Base):
     __tablename__ = 'order_dish'
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    order_id = Column(Integer, ForeignKey('order.id'), nullable=False)
-    dish_id = Column(Integer, ForeignKey('dish.id'), nullable=False)
+    order_id = Column(Integer, ForeignKey('order.id'), nullable=False, index=True)
+    dish_id = Column(Integer, nullable=False)
     quantity = Column(Integer, nullable=False)
     price = Column(DECIMAL(10, 2), nullable=False)
 
     order = relationship("Order", back_populates="order_dishes")
-    dish = relationship("Dish")
+
+class OrderArchive(Base):
+    # Закрытые заказы старше ORDER_ARCHIVE_AFTER_DAYS, переносятся из order
+    # архиватором. Секции по месяцам created_at создаются по мере надобности.
+    __tablename__ = 'order_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    user_id = Column(Integer, nullable=False)
+    status = Column(String(30), nullable=False)
+    special_requests = Column(Text)
+    created_at = Column(DateTime(timezone=True), primary_key=True)
+    updated_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+class OrderDishArchive(Base):
+    __tablename__ = 'order_dish_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    order_id = Column(Integer, nullable=False, index=True)
+    dish_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    price = Column(DECIMAL(10, 2), nullable=False)
+    # Дата заказа, по ней позиции лежат в той же секции, что и заказ
+    order_created_at = Column(DateTime(timezone=True), primary_key=True)
+
+    __table_args__ = (
+        {'postgresql_partition_by': 'RANGE (order_created_at)'},
+    )
+
+class DishSalesRollup(Base):
+    # Продажи блюда за час или день, обновляются вместе с заказами
+    __tablename__ = 'dish_sales_rollup'
+
+    granularity = Column(String(10), primary_key=True)
+    bucket = Column(DateTime(timezone=True), primary_key=True)
+    dish_id = Column(Integer, primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(DECIMAL(12, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        CheckConstraint("granularity IN ('hour', 'day')"),
+    )
+
+class OrderStatusCount(Base):
+    # Счётчик заказов по статусам, разбит на слоты, чтобы параллельные
+    # транзакции не ждали блокировку одной и той же строки
+    __tablename__ = 'order_status_count'
+
+    status = Column(String(30), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class UserShard(Base):
+    # Пользователи, перенесённые на шард не по хэшу (orders.rebalance).
+    # Только в основной базе
+    __tablename__ = 'user_shard'
+
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(Integer, nullable=False)
+
+# create_all не меняет уже существующие таблицы: колонки и индексы,
+# появившиеся после первого выпуска, догоняются при старте. Первый старт после
+# обновления строит индексы, запись в эти таблицы на это время ждёт. Таблицы,
+# которой в базе нет (dish на шарде), это не касается
+UPGRADE_COLUMNS = {
+    'dish': [
+        f"ADD COLUMN IF NOT EXISTS prep_time INTEGER NOT NULL DEFAULT {DEFAULT_PREP_TIME}",
+        "ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT now()",
+    ],
+}
+UPGRADE_INDEXES = (
+    # Проверка дубликатов и поиск блюд
+    'ix_dish_name',
+    'ix_dish_name_trgm',
+    'ix_dish_description_trgm',
+    'ix_dish_name_prefix',
+    # Кухня и списки заказов
+    'ix_order_created_at',
+    'ix_order_open_status',
+    # Позиции заказа: выборки кухни, удаление при архивировании
+    'ix_order_dish_order_id',
+)
+
+def upgrade_existing_tables(target, connection, **kw):
+    existing = set(inspect(connection).get_table_names())
+    for table, changes in UPGRADE_COLUMNS.items():
+        if table in existing:
+            for change in changes:
+                connection.execute(text(f'ALTER TABLE {table} {change}'))
+    indexes = {index.name: index for table in target.tables.values() for index in table.indexes}
+    for name in UPGRADE_INDEXES:
+        if indexes[name].table.name in existing:
+            connection.execute(CreateIndex(indexes[name], if_not_exists=True))
+
+event.listen(Base.metadata, 'after_create', upgrade_existing_tables)
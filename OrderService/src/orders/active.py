@@ -0,0 +1,231 @@
+# Компактный индекс незакрытых заказов для экранов кухни. Индекс свой у
+# каждого процесса: строится из базы при прогреве (до готовности процесса),
+# обновляется из путей
+# изменения статуса и раз в ACTIVE_ORDERS_RESYNC_INTERVAL секунд сверяется
+# с базой, чтобы подхватить изменения, сделанные другими процессами.
+import asyncio
+import logging
+import os
+import sys
+from array import array
+from datetime import datetime, timezone
+from threading import Lock
+
+import metrics
+import warmup
+from models import Order, OrderDish
+from sharding import ShardSessions
+
+# 0 — не сверять с базой после старта
+ACTIVE_ORDERS_RESYNC_INTERVAL = int(os.getenv("ACTIVE_ORDERS_RESYNC_INTERVAL", "60"))
+
+ACTIVE_STATUSES = ("pending", "in_progress")
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveOrder:
+    __slots__ = ("id", "user_id", "status", "created_at", "dishes")
+
+    def __init__(self, order_id: int, user_id: int, status: str, created_at: float, dishes: array):
+        self.id = order_id
+        self.user_id = user_id
+        self.status = status
+        self.created_at = created_at
+        # Плоский массив пар: dish_id, quantity, dish_id, quantity, ...
+        self.dishes = dishes
+
+    def items(self):
+        return zip(self.dishes[::2], self.dishes[1::2])
+
+
+def _timestamp(value) -> float:
+    return value.timestamp() if value is not None else 0.0
+
+
+def _pack_dishes(items) -> array:
+    dishes = array("i")
+    for dish_id, quantity in items:
+        dishes.append(dish_id)
+        dishes.append(quantity)
+    return dishes
+
+
+class ActiveOrderIndex:
+    def __init__(self):
+        self._orders = {}
+        # статус -> id заказов
+        self._by_status = {status: set() for status in ACTIVE_STATUSES}
+        # dish_id -> порций в работе, по одной ячейке на статус
+        self._dish_units = {}
+        self._lock = Lock()
+        # Изменения, пришедшие во время перестроения, применяются поверх снимка
+        self._replay = None
+        self.rebuilds = 0
+
+    def _link(self, order: ActiveOrder, sign: int):
+        slot = ACTIVE_STATUSES.index(order.status)
+        for dish_id, quantity in order.items():
+            units = self._dish_units.get(dish_id)
+            if units is None:
+                units = self._dish_units[dish_id] = array("i", [0] * len(ACTIVE_STATUSES))
+            units[slot] += sign * quantity
+            if not any(units):
+                del self._dish_units[dish_id]
+        if sign > 0:
+            self._by_status[order.status].add(order.id)
+        else:
+            self._by_status[order.status].discard(order.id)
+
+    def _add(self, order: ActiveOrder):
+        self._remove(order.id)
+        if order.status not in ACTIVE_STATUSES:
+            return
+        self._orders[order.id] = order
+        self._link(order, 1)
+
+    def _remove(self, order_id: int):
+        order = self._orders.pop(order_id, None)
+        if order is not None:
+            self._link(order, -1)
+
+    def _set_status(self, order_id: int, status: str):
+        order = self._orders.get(order_id)
+        if order is None:
+            # Заказ создан другим процессом; его подхватит сверка с базой
+            return
+        self._link(order, -1)
+        if status in ACTIVE_STATUSES:
+            order.status = status
+            self._link(order, 1)
+        else:
+            del self._orders[order_id]
+
+    def _apply(self, change: tuple):
+        method, args = change
+        method(*args)
+        if self._replay is not None:
+            self._replay.append(change)
+
+    def add(self, order_id: int, user_id: int, status: str, created_at, items):
+        order = ActiveOrder(order_id, user_id, status, _timestamp(created_at), _pack_dishes(items))
+        with self._lock:
+            self._apply((self._add, (order,)))
+
+    def set_status(self, order_id: int, status: str):
+        with self._lock:
+            self._apply((self._set_status, (order_id, status)))
+
+    def remove(self, order_id: int):
+        with self._lock:
+            self._apply((self._remove, (order_id,)))
+
+    def rebuild(self):
+        with self._lock:
+            self._replay = []
+        try:
+            orders = load_active_orders()
+        except Exception:
+            with self._lock:
+                self._replay = None
+            raise
+
+        with self._lock:
+            replay, self._replay = self._replay, None
+            self._orders = {}
+            self._by_status = {status: set() for status in ACTIVE_STATUSES}
+            self._dish_units = {}
+            for order in orders:
+                self._add(order)
+            for method, args in replay:
+                method(*args)
+            self.rebuilds += 1
+
+    def snapshot(self, status: str = None) -> tuple:
+        with self._lock:
+            if status is None:
+                orders = list(self._orders.values())
+            else:
+                orders = [self._orders[order_id] for order_id in self._by_status.get(status, ())]
+            orders = [
+                (order.id, order.user_id, order.status, order.created_at, list(order.items()))
+                for order in orders
+            ]
+            dishes = [(dish_id, tuple(units)) for dish_id, units in self._dish_units.items()]
+        orders.sort(key=lambda order: order[3])
+        dishes.sort()
+        return orders, dishes
+
+    def memory_bytes(self) -> int:
+        # Оценка снизу: контейнеры, записи и массивы позиций без общих int
+        with self._lock:
+            size = sys.getsizeof(self._orders) + sys.getsizeof(self._dish_units)
+            for order in self._orders.values():
+                size += sys.getsizeof(order) + sys.getsizeof(order.dishes)
+            for order_ids in self._by_status.values():
+                size += sys.getsizeof(order_ids)
+            for units in self._dish_units.values():
+                size += sys.getsizeof(units)
+        return size
+
+    def collect_metrics(self) -> dict:
+        with self._lock:
+            stats = {status: len(order_ids) for status, order_ids in self._by_status.items()}
+            stats["dishes"] = len(self._dish_units)
+        stats["memory_bytes"] = self.memory_bytes()
+        stats["rebuilds"] = self.rebuilds
+        return stats
+
+
+def load_shard_active_orders(db) -> list:
+    rows = (
+        db.query(Order.id, Order.user_id, Order.status, Order.created_at)
+        .filter(Order.status.in_(ACTIVE_STATUSES))
+        .all()
+    )
+    items = {}
+    for order_id, dish_id, quantity in (
+        db.query(OrderDish.order_id, OrderDish.dish_id, OrderDish.quantity)
+        .join(Order, Order.id == OrderDish.order_id)
+        .filter(Order.status.in_(ACTIVE_STATUSES))
+    ):
+        items.setdefault(order_id, []).append((dish_id, quantity))
+    return [
+        ActiveOrder(order_id, user_id, status, _timestamp(created_at), _pack_dishes(items.get(order_id, ())))
+        for order_id, user_id, status, created_at in rows
+    ]
+
+
+def load_active_orders() -> list:
+    sessions = ShardSessions()
+    try:
+        return [
+            order
+            for shard_orders in sessions.map(load_shard_active_orders)
+            for order in shard_orders
+        ]
+    finally:
+        sessions.close()
+
+
+def to_datetime(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp, timezone.utc)
+
+
+active_orders = ActiveOrderIndex()
+metrics.register("active_orders", active_orders.collect_metrics)
+# Первое построение — шаг прогрева: он повторяется, пока база не ответит,
+# и до него GET /ready отвечает 503, а не отдаёт пустой индекс
+warmup.register(active_orders.rebuild)
+
+
+async def run_active_orders_sync():
+    # Периодическая сверка после прогрева
+    if ACTIVE_ORDERS_RESYNC_INTERVAL <= 0:
+        return
+    while True:
+        await asyncio.sleep(ACTIVE_ORDERS_RESYNC_INTERVAL)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, active_orders.rebuild)
+        except Exception:
+            logger.exception("Active orders index rebuild failed")
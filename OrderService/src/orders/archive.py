@@ -0,0 +1,123 @@
+# Перенос закрытых заказов в архив, секционированный по месяцам.
+# В таблицах order/order_dish остаются только свежие и незакрытые заказы,
+# поэтому запросы кухни и списков не просматривают многолетнюю историю.
+# Разовый запуск из каталога src:
+#   python -m orders.archive --older-than-days 90
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from database import create_all_tables
+from sharding import SHARD_COUNT, ShardSessions, create_shard_tables
+
+ORDER_ARCHIVE_AFTER_DAYS = int(os.getenv("ORDER_ARCHIVE_AFTER_DAYS", "90"))
+# Период фонового архивирования в секундах; 0 — только вручную
+ORDER_ARCHIVE_INTERVAL = int(os.getenv("ORDER_ARCHIVE_INTERVAL", "3600"))
+ORDER_ARCHIVE_BATCH_SIZE = int(os.getenv("ORDER_ARCHIVE_BATCH_SIZE", "1000"))
+
+CLOSED_STATUSES = "('completed', 'cancelled')"
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_MONTHS = text(f"""
+    SELECT DISTINCT date_trunc('month', created_at)
+    FROM "order"
+    WHERE status IN {CLOSED_STATUSES} AND created_at < :cutoff
+""")
+
+# Один оператор: удаляет пачку заказов вместе с позициями и вставляет их
+# в архив. SKIP LOCKED позволяет запускать архиватор в нескольких процессах.
+MOVE_BATCH = text(f"""
+    WITH batch AS (
+        SELECT id FROM "order"
+        WHERE status IN {CLOSED_STATUSES} AND created_at < :cutoff
+        ORDER BY id
+        LIMIT :batch_size
+        FOR UPDATE SKIP LOCKED
+    ), moved_dishes AS (
+        DELETE FROM order_dish d USING batch b
+        WHERE d.order_id = b.id
+        RETURNING d.id, d.order_id, d.dish_id, d.quantity, d.price
+    ), moved_orders AS (
+        DELETE FROM "order" o USING batch b
+        WHERE o.id = b.id
+        RETURNING o.id, o.user_id, o.status, o.special_requests, o.created_at, o.updated_at
+    ), archived_dishes AS (
+        INSERT INTO order_dish_archive (id, order_id, dish_id, quantity, price, order_created_at)
+        SELECT md.id, md.order_id, md.dish_id, md.quantity, md.price, mo.created_at
+        FROM moved_dishes md JOIN moved_orders mo ON mo.id = md.order_id
+    )
+    INSERT INTO order_archive (id, user_id, status, special_requests, created_at, updated_at)
+    SELECT id, user_id, status, special_requests, created_at, updated_at FROM moved_orders
+""")
+
+
+def ensure_partitions(db, month: datetime):
+    start = month.isoformat()
+    suffix = month.strftime("%Y_%m")
+    for table in ("order_archive", "order_dish_archive"):
+        db.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {table}_{suffix} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO (TIMESTAMPTZ '{start}' + INTERVAL '1 month')"
+        ))
+
+
+def archive_closed_orders(db, older_than_days: int, batch_size: int = ORDER_ARCHIVE_BATCH_SIZE) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+
+    for month in db.execute(ARCHIVE_MONTHS, {"cutoff": cutoff}).scalars().all():
+        ensure_partitions(db, month)
+    db.commit()
+
+    total = 0
+    while True:
+        moved = db.execute(MOVE_BATCH, {"cutoff": cutoff, "batch_size": batch_size}).rowcount
+        db.commit()
+        total += moved
+        if moved < batch_size:
+            return total
+
+
+def run_once(older_than_days: int) -> int:
+    # Шарды архивируются по очереди, каждый своими пачками
+    sessions = ShardSessions()
+    try:
+        return sum(
+            archive_closed_orders(sessions[shard], older_than_days)
+            for shard in range(SHARD_COUNT)
+        )
+    finally:
+        sessions.close()
+
+
+async def run_archiver():
+    if ORDER_ARCHIVE_INTERVAL <= 0:
+        return
+    while True:
+        try:
+            moved = await asyncio.get_running_loop().run_in_executor(
+                None, run_once, ORDER_ARCHIVE_AFTER_DAYS
+            )
+            if moved:
+                logger.info("Archived %s closed orders", moved)
+        except Exception:
+            logger.exception("Order archiving failed")
+        await asyncio.sleep(ORDER_ARCHIVE_INTERVAL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move closed orders into monthly archive partitions")
+    parser.add_argument("--older-than-days", type=int, default=ORDER_ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+
+    create_all_tables()
+    create_shard_tables()
+    print(f"Archived {run_once(args.older_than_days)} closed orders")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# Пакетное изменение статусов заказов: один UPDATE ... FROM (VALUES ...)
+# на пачку пар (заказ, статус). Одиночные PUT /orders/{id}/status, пришедшие
+# в пределах ORDER_STATUS_COALESCE_MS миллисекунд, могут склеиваться в одну пачку.
+import os
+from threading import Event, Lock
+
+from sqlalchemy import bindparam, text
+
+import metrics
+from query_budget import QUERY_BUDGET_MODE, check_budget, count_queries
+from sharding import SHARD_COUNT, SHARDED, ShardSessions, guess_order_shard
+from analytics.rollups import record_orders_sales, record_status_changes
+from orders.events import hub
+from orders.active import active_orders
+
+# 0 — не склеивать одиночные обновления
+ORDER_STATUS_COALESCE_MS = float(os.getenv("ORDER_STATUS_COALESCE_MS", "0"))
+ORDER_STATUS_BATCH_MAX = int(os.getenv("ORDER_STATUS_BATCH_MAX", "500"))
+# Ожидающие склейки запросы держат потоки пула (40 по умолчанию) до конца
+# окна; сверх этого числа обновление идёт напрямую, без склейки
+ORDER_STATUS_COALESCE_MAX_WAITERS = int(os.getenv("ORDER_STATUS_COALESCE_MAX_WAITERS", "10"))
+
+# Бюджет запросов одного вызова apply_sharded_status_updates: на каждом
+# шарде UPDATE, счётчики статусов и продажи за час и день (при отмене), и
+# столько же ещё раз, если заказы ищутся на остальных шардах после переноса
+STATUS_UPDATE_QUERY_BUDGET = 8 * SHARD_COUNT if SHARDED else 4
+
+# Закрытые заказы (completed, cancelled) больше не меняют статус
+OPEN_STATUSES = ("pending", "in_progress")
+
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+NOT_FOUND = "not_found"
+INVALID_TRANSITION = "invalid_transition"
+
+_stats = {"batches": 0, "updates": 0, "coalesced_batches": 0, "coalesced_updates": 0, "direct_updates": 0}
+_stats_lock = Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for name, delta in deltas.items():
+            _stats[name] += delta
+
+
+def _update_statement(updates: list):
+    # Строки заказов блокируются в порядке id, прежний статус берётся из
+    # заблокированной версии строки — по нему обновляются счётчики статусов
+    values = ", ".join(
+        f"(CAST(:id_{i} AS integer), CAST(:status_{i} AS varchar))"
+        for i in range(len(updates))
+    )
+    params = {}
+    for i, (order_id, status) in enumerate(updates):
+        params[f"id_{i}"] = order_id
+        params[f"status_{i}"] = status
+    statement = text(f"""
+        WITH changes (id, status) AS (VALUES {values}),
+        locked AS (
+            SELECT o.id, o.status
+            FROM "order" o JOIN changes c ON c.id = o.id
+            ORDER BY o.id
+            FOR UPDATE OF o
+        ),
+        updated AS (
+            UPDATE "order" o
+            SET status = c.status, updated_at = now()
+            FROM changes c JOIN locked l ON l.id = c.id
+            WHERE o.id = c.id
+              AND l.status IN :open_statuses
+              AND l.status <> c.status
+            RETURNING o.id
+        )
+        SELECT c.id, c.status, l.status AS old_status, u.id IS NOT NULL AS updated
+        FROM changes c
+        LEFT JOIN locked l ON l.id = c.id
+        LEFT JOIN updated u ON u.id = c.id
+    """)
+    return statement.bindparams(
+        bindparam("open_statuses", OPEN_STATUSES, expanding=True),
+        **params,
+    )
+
+
+def apply_status_updates(db, updates: list) -> list:
+    # updates — список (order_id, status) без повторов order_id.
+    # Возвращает (order_id, текущий статус, исход) в порядке запроса;
+    # commit и публикация событий остаются за вызывающим.
+    if not updates:
+        return []
+    rows = {
+        row.id: row
+        for row in db.execute(_update_statement(updates))
+    }
+
+    results = []
+    transitions = []
+    cancelled = []
+    for order_id, status in updates:
+        row = rows.get(order_id)
+        if row is None or row.old_status is None:
+            results.append((order_id, None, NOT_FOUND))
+        elif row.updated:
+            results.append((order_id, status, UPDATED))
+            transitions.append((row.old_status, status))
+            if status == "cancelled":
+                cancelled.append(order_id)
+        elif row.old_status == status:
+            results.append((order_id, status, UNCHANGED))
+        else:
+            results.append((order_id, row.old_status, INVALID_TRANSITION))
+
+    record_status_changes(db, transitions)
+    # Отменённые заказы не учитываются в продажах
+    record_orders_sales(db, cancelled, sign=-1)
+    _count(batches=1, updates=len(transitions))
+    return results
+
+
+def apply_sharded_status_updates(sessions: ShardSessions, updates: list) -> list:
+    # То же на шардах: каждая пара уходит на шард, где заказ создан, а не
+    # найденные там (перенесённые ребалансировкой) ищутся на остальных.
+    # commit на всех шардах остаётся за вызывающим.
+    groups = {}
+    for order_id, status in updates:
+        groups.setdefault(guess_order_shard(order_id), []).append((order_id, status))
+    results = {}
+    for shard_results in sessions.map(apply_status_updates, list(groups), list(groups.values())):
+        for result in shard_results:
+            results[result[0]] = result
+
+    retries = {}
+    for order_id, status in updates:
+        if results[order_id][2] != NOT_FOUND:
+            continue
+        home = guess_order_shard(order_id)
+        for shard in range(SHARD_COUNT):
+            if shard != home:
+                retries.setdefault(shard, []).append((order_id, status))
+    if retries:
+        for shard_results in sessions.map(apply_status_updates, list(retries), list(retries.values())):
+            for result in shard_results:
+                if result[2] != NOT_FOUND:
+                    results[result[0]] = result
+    return [results[order_id] for order_id, _ in updates]
+
+
+def publish_results(results: list):
+    for order_id, status, outcome in results:
+        if outcome == UPDATED:
+            active_orders.set_status(order_id, status)
+            hub.publish(order_id, status)
+
+
+class _Waiter:
+    __slots__ = ("order_id", "status", "event", "result", "error")
+
+    def __init__(self, order_id: int, status: str):
+        self.order_id = order_id
+        self.status = status
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+
+class StatusUpdateCoalescer:
+    # Первый запрос в окне становится ведущим: ждёт окно, забирает накопленную
+    # пачку и применяет её в своей транзакции, остальные ждут результата
+    def __init__(
+        self,
+        window: float,
+        max_batch: int = ORDER_STATUS_BATCH_MAX,
+        max_waiters: int = ORDER_STATUS_COALESCE_MAX_WAITERS,
+    ):
+        self.window = window
+        self.max_batch = max_batch
+        self.max_waiters = max_waiters
+        self._pending = None
+        self._full = None
+        self._waiting = 0
+        self._lock = Lock()
+
+    def submit(self, order_id: int, status: str):
+        # Возвращает None, если ждущих уже max_waiters: тогда вызывающий
+        # обновляет заказ сам
+        with self._lock:
+            if self._waiting >= self.max_waiters:
+                _count(direct_updates=1)
+                return None
+            self._waiting += 1
+        try:
+            return self._submit(order_id, status)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _submit(self, order_id: int, status: str) -> tuple:
+        waiter = _Waiter(order_id, status)
+        with self._lock:
+            leader = self._pending is None
+            if leader:
+                self._pending = []
+                self._full = Event()
+            batch, full = self._pending, self._full
+            batch.append(waiter)
+            # Новые запросы всё равно пойдут мимо пачки, ждать окно незачем
+            if len(batch) >= self.max_batch or self._waiting >= self.max_waiters:
+                full.set()
+
+        if leader:
+            full.wait(self.window)
+            with self._lock:
+                self._pending = None
+                self._full = None
+            # Пачка общая для всех ожидающих запросов: её SQL проверяется по
+            # своему бюджету (раунд — вызов apply_sharded_status_updates), а не
+            # по бюджету запроса-ведущего. Ждущие уже получили результат
+            with count_queries() as counter:
+                rounds = self._flush(batch)
+            if QUERY_BUDGET_MODE != "off":
+                check_budget("status update batch", STATUS_UPDATE_QUERY_BUDGET * rounds, counter)
+
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.result
+
+    def _flush(self, batch: list) -> int:
+        # Повторы одного заказа уходят в следующий раунд, чтобы порядок
+        # обновлений сохранился. Возвращает число раундов
+        rounds = []
+        for waiter in batch:
+            for round_waiters in rounds:
+                if all(w.order_id != waiter.order_id for w in round_waiters):
+                    round_waiters.append(waiter)
+                    break
+            else:
+                rounds.append([waiter])
+
+        sessions = ShardSessions()
+        try:
+            results = []
+            for round_waiters in rounds:
+                results.extend(zip(round_waiters, apply_sharded_status_updates(
+                    sessions, [(w.order_id, w.status) for w in round_waiters],
+                )))
+            sessions.commit()
+        except Exception as e:
+            for waiter in batch:
+                waiter.error = e
+                waiter.event.set()
+            return len(rounds)
+        finally:
+            sessions.close()
+
+        _count(coalesced_batches=1, coalesced_updates=len(batch))
+        publish_results([result for _, result in results])
+        for waiter, result in results:
+            waiter.result = result
+            waiter.event.set()
+        return len(rounds)
+
+
+coalescer = StatusUpdateCoalescer(ORDER_STATUS_COALESCE_MS / 1000) if ORDER_STATUS_COALESCE_MS > 0 else None
+
+
+def _collect_metrics() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["coalesce_ms"] = ORDER_STATUS_COALESCE_MS
+    stats["coalesce_max_waiters"] = ORDER_STATUS_COALESCE_MAX_WAITERS
+    return stats
+
+
+metrics.register("order_status_batches", _collect_metrics)
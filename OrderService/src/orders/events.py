@@ -0,0 +1,107 @@
+# Рассылка изменений статусов заказов подписчикам (Server-Sent Events).
+# Один хаб на процесс: события публикуются из обработчиков и process_orders,
+# подписчики получают их из своих очередей без обращений к базе данных.
+import asyncio
+import json
+from threading import Lock
+
+import metrics
+
+TERMINAL_STATUSES = ("completed", "cancelled")
+KEEPALIVE_INTERVAL = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class OrderEventHub:
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._loop = None
+        # очередь подписчика -> id заказа (None — все заказы)
+        self._subscribers = {}
+        self._lock = Lock()
+        self.published = 0
+        self.dropped_subscribers = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self, order_id: int = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers[queue] = order_id
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def publish(self, order_id: int, status: str):
+        if self._loop is None:
+            return
+        event = {"order_id": order_id, "status": status}
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self._loop:
+            self._dispatch(event)
+        else:
+            # Синхронные обработчики выполняются в пуле потоков
+            self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event: dict):
+        self.published += 1
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, order_id in subscribers:
+            if order_id is not None and order_id != event["order_id"]:
+                continue
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Медленный клиент: отключаем его, EventSource переподключится сам
+                self.unsubscribe(queue)
+                self.dropped_subscribers += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def collect_metrics(self) -> dict:
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            "subscribers": subscribers,
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers,
+        }
+
+
+hub = OrderEventHub()
+metrics.register("order_events", hub.collect_metrics)
+
+
+def format_event(event: dict) -> str:
+    return f"event: status\ndata: {json.dumps(event)}\n\n"
+
+
+async def stream_events(request, queue: asyncio.Queue, initial_event: dict = None):
+    try:
+        if initial_event is not None:
+            yield format_event(initial_event)
+            if initial_event["status"] in TERMINAL_STATUSES:
+                return
+        while True:
+            if await request.is_disconnected():
+                return
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield format_event(event)
+            if initial_event is not None and event["status"] in TERMINAL_STATUSES:
+                return
+    finally:
+        hub.unsubscribe(queue)
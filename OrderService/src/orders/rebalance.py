@@ -0,0 +1,204 @@
+# Перенос заказов пользователей между шардами. Заказы переезжают вместе
+# с позициями и архивом, агрегаты продаж и счётчики статусов поправляются
+# на обоих шардах. Пока пользователь переносится, его новые заказы ждут
+# (advisory-блокировка в основной базе, см. sharding.route_user).
+# Запуск из каталога src:
+#   python -m orders.rebalance --report
+#   python -m orders.rebalance --user 42 --to 1
+#   python -m orders.rebalance --rehash   # после изменения ORDER_SHARDS
+import argparse
+
+from sqlalchemy import delete, func, insert, select, text, union
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from database import SessionLocal, create_all_tables
+from models import Order, OrderArchive, OrderDish, OrderDishArchive, UserShard
+from sharding import (
+    SHARD_COUNT,
+    USER_LOCK_NAMESPACE,
+    ShardSessions,
+    create_shard_tables,
+    default_shard,
+)
+from analytics.rollups import record_orders_sales, record_status_changes
+from orders.archive import ensure_partitions
+
+
+def _select_rows(db, table, condition, lock: bool = False) -> list:
+    query = select(table).where(condition).order_by(table.c.id)
+    if lock:
+        query = query.with_for_update()
+    return [dict(row._mapping) for row in db.execute(query)]
+
+
+def _copy_user_orders(source, target, user_id: int) -> int:
+    # Копирует заказы пользователя с source на target и поправляет агрегаты
+    # на обоих; commit остаётся за вызывающим. Строки source заблокированы
+    # до его commit, поэтому статусы переносимых заказов не меняются.
+    orders = _select_rows(source, Order.__table__, Order.user_id == user_id, lock=True)
+    order_ids = [order["id"] for order in orders]
+    items = _select_rows(source, OrderDish.__table__, OrderDish.order_id.in_(order_ids)) if orders else []
+    archived = _select_rows(source, OrderArchive.__table__, OrderArchive.user_id == user_id, lock=True)
+    archived_ids = [order["id"] for order in archived]
+    archived_items = (
+        _select_rows(source, OrderDishArchive.__table__, OrderDishArchive.order_id.in_(archived_ids))
+        if archived else []
+    )
+    if not orders and not archived:
+        return 0
+
+    sold = [order["id"] for order in orders if order["status"] != "cancelled"]
+    sold_archived = [order["id"] for order in archived if order["status"] != "cancelled"]
+    statuses = [order["status"] for order in orders + archived]
+
+    for month in sorted({order["created_at"].replace(day=1, hour=0, minute=0, second=0, microsecond=0) for order in archived}):
+        ensure_partitions(target, month)
+    for table, rows in (
+        (Order.__table__, orders),
+        (OrderDish.__table__, items),
+        (OrderArchive.__table__, archived),
+        (OrderDishArchive.__table__, archived_items),
+    ):
+        if rows:
+            target.execute(insert(table), rows)
+    record_orders_sales(target, sold)
+    record_orders_sales(target, sold_archived, archived=True)
+    record_status_changes(target, [(None, status) for status in statuses])
+
+    # Продажи вычитаются до удаления строк, по которым они считаются
+    record_orders_sales(source, sold, sign=-1)
+    record_orders_sales(source, sold_archived, sign=-1, archived=True)
+    record_status_changes(source, [(status, None) for status in statuses])
+    if orders:
+        source.execute(delete(OrderDish.__table__).where(OrderDish.order_id.in_(order_ids)))
+        source.execute(delete(Order.__table__).where(Order.id.in_(order_ids)))
+    if archived:
+        source.execute(delete(OrderDishArchive.__table__).where(OrderDishArchive.order_id.in_(archived_ids)))
+        source.execute(delete(OrderArchive.__table__).where(OrderArchive.id.in_(archived_ids)))
+    return len(orders) + len(archived)
+
+
+def move_user(user_id: int, target: int) -> int:
+    # Возвращает число перенесённых заказов
+    if not 0 <= target < SHARD_COUNT:
+        raise ValueError(f"Shard {target} does not exist, there are {SHARD_COUNT} shards")
+    catalog = SessionLocal()
+    sessions = ShardSessions()
+    try:
+        # Ждёт завершения текущих заказов пользователя и не пускает новые
+        catalog.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :user_id)"),
+            {"namespace": USER_LOCK_NAMESPACE, "user_id": user_id},
+        )
+        moved = 0
+        for source in range(SHARD_COUNT):
+            if source == target:
+                continue
+            count = _copy_user_orders(sessions[source], sessions[target], user_id)
+            if count:
+                # Сначала target: пока source не закоммичен, заказы видны
+                # на обоих шардах, списки отбрасывают повторы
+                sessions[target].commit()
+                sessions[source].commit()
+                moved += count
+            else:
+                sessions[source].rollback()
+
+        if target == default_shard(user_id):
+            catalog.execute(delete(UserShard).where(UserShard.user_id == user_id))
+        else:
+            stmt = pg_insert(UserShard).values(user_id=user_id, shard=target)
+            catalog.execute(stmt.on_conflict_do_update(
+                index_elements=[UserShard.user_id],
+                set_={"shard": stmt.excluded.shard},
+            ))
+        catalog.commit()
+        return moved
+    finally:
+        sessions.close()
+        catalog.close()
+
+
+def user_shards() -> dict:
+    # Шард каждого пользователя: из справочника или по хэшу
+    catalog = SessionLocal()
+    try:
+        return dict(catalog.query(UserShard.user_id, UserShard.shard).all())
+    finally:
+        catalog.close()
+
+
+def shard_users(db) -> list:
+    return db.execute(union(
+        select(Order.user_id),
+        select(OrderArchive.user_id),
+    )).scalars().all()
+
+
+def rehash() -> int:
+    # Переносит пользователей, чьи заказы лежат не на их шарде
+    directory = user_shards()
+    sessions = ShardSessions()
+    try:
+        misplaced = []
+        for shard, users in enumerate(sessions.map(shard_users)):
+            for user_id in users:
+                target = directory.get(user_id)
+                if target is None or target >= SHARD_COUNT:
+                    target = default_shard(user_id)
+                if target != shard:
+                    misplaced.append((user_id, target))
+    finally:
+        sessions.close()
+
+    moved = 0
+    for user_id, target in sorted(set(misplaced)):
+        moved += move_user(user_id, target)
+    return moved
+
+
+def shard_report(db) -> tuple:
+    return (
+        db.query(func.count(func.distinct(Order.user_id)), func.count()).one(),
+        db.query(func.count(func.distinct(OrderArchive.user_id)), func.count()).one(),
+    )
+
+
+def report():
+    directory = user_shards()
+    sessions = ShardSessions()
+    try:
+        rows = sessions.map(shard_report)
+    finally:
+        sessions.close()
+    for shard, ((users, orders), (archived_users, archived)) in enumerate(rows):
+        pinned = sum(1 for target in directory.values() if target == shard)
+        print(
+            f"shard {shard}: {orders} orders of {users} users, "
+            f"{archived} archived orders of {archived_users} users, {pinned} pinned users"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move users' orders between order shards")
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument("--user", type=int, help="Move this user's orders to the shard given by --to")
+    mode.add_argument("--rehash", action="store_true", help="Move every user whose orders are on the wrong shard")
+    mode.add_argument("--report", action="store_true", help="Print orders and users per shard")
+    parser.add_argument("--to", type=int, help="Target shard number")
+    args = parser.parse_args()
+    if args.user is not None and args.to is None:
+        parser.error("--user requires --to")
+
+    create_all_tables()
+    create_shard_tables()
+    if args.report:
+        report()
+    elif args.rehash:
+        print(f"Moved {rehash()} orders")
+    else:
+        print(f"Moved {move_user(args.user, args.to)} orders of user {args.user} to shard {args.to}")
+
+
+if __name__ == "__main__":
+    main()
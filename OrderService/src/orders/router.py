@@ -1,8 +1,40 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import insert, select, union_all
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta
-from database import get_db
-from models import User, Order, Dish
+from typing import Optional
+import heapq
+from database import SessionLocal, get_db, get_read_db
+from models import User, Order, OrderDish, OrderArchive, Dish
+from auth_client import get_user_by_id
+import tracing
+from query_budget import query_budget
+from admission import limit_from_env
+from conditional import conditional_list, version_columns
+import warmup
+from sharding import (
+    SHARD_COUNT,
+    SHARDED,
+    ShardSessions,
+    find_order,
+    get_read_shards,
+    get_shards,
+    read_session_factories,
+    route_user,
+)
+from orders.events import hub, stream_events
+from orders.active import ACTIVE_STATUSES, active_orders, to_datetime
+from analytics.rollups import record_sales, record_status_change, record_order_sales
+from orders.batch import (
+    INVALID_TRANSITION,
+    NOT_FOUND,
+    ORDER_STATUS_BATCH_MAX,
+    STATUS_UPDATE_QUERY_BUDGET,
+    apply_sharded_status_updates,
+    coalescer,
+    publish_results,
+)
 from orders.schemas import (
     OrderCreateRequest,
     OrderCreateResponse,
@@ -10,11 +42,13 @@ from orders.schemas import (
     OrderStatusUpdateRequest,
     OrderStatusUpdateResponse,
     OrderStatusUpdateErrorResponse,
+    OrderStatusBatchRequest,
+    OrderStatusBatchResponse,
     OrderResponce,
     OrderListResponse,
+    OrderStatus,
+    ActiveOrdersResponse,
 )
-import requests
-from requests.exceptions import RequestException
 import jwt
 from dotenv import load_dotenv
 from jwt.exceptions import ExpiredSignatureError, PyJWTError
@@ -30,34 +64,15 @@ if JWT_SECRET is None:
 
 security = HTTPBearer()
 
-AUTH_SERVICE_HOST = os.getenv("AUTH_SERVICE_HOST")
-
-
-def get_user_by_id(user_id: int) -> User:
-    try:
-        url = f"http://{AUTH_SERVICE_HOST}:8000/users/{user_id}"
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            user_data = response.json()
-            user = User(**user_data)
-            return user
-        else:
-            raise HTTPException(
-                status_code=response.status_code,
-                detail="Failed to fetch user data",
-            )
-    except RequestException as e:
-        print(f"An error occurred during the request: {e}")
-        return None
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        return None
+# Полный список заказов тяжёлый: частота на клиента и число одновременных
+# запросов ограничены, чтобы он не занимал все потоки пула
+order_list_limit = limit_from_env("order_list", rate=1, burst=5, concurrency=2)
 
 
 def get_current_user(token: str = Depends(security), db: Session = Depends(get_db)):
     try:
-        payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
+        with tracing.start_span("jwt.decode"):
+            payload = jwt.decode(token.credentials, JWT_SECRET, algorithms=["HS256"])
     except ExpiredSignatureError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -87,20 +102,33 @@ def get_current_user(token: str = Depends(security), db: Session = Depends(get_d
 
 
 @router.post("", response_model=OrderCreateResponse, status_code=status.HTTP_201_CREATED)
+@query_budget(7 if SHARDED else 6)
 def create_order(
     order_data: OrderCreateRequest,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
 ):
-    user = get_user_by_id(current_user.user_id)
+    user = get_user_by_id(current_user.id)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="User not found",
         )
 
+    # Заказ пишется на шард пользователя, остатки блюд — в каталог
+    shard_db = shards[route_user(db, current_user.id)]
+
+    # Все блюда заказа одним запросом; FOR UPDATE защищает остатки от гонки
+    dish_ids = sorted({dish_item.dish_id for dish_item in order_data.dishes})
+    dishes = {
+        dish.id: dish
+        for dish in db.query(Dish).filter(Dish.id.in_(dish_ids)).order_by(Dish.id).with_for_update()
+    }
+
+    items = []
     for dish_item in order_data.dishes:
-        dish = db.query(Dish).filter(Dish.id == dish_item.dish_id).first()
+        dish = dishes.get(dish_item.dish_id)
         if not dish or dish.quantity == 0:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -112,27 +140,90 @@ def create_order(
                 detail=f"Only {dish.quantity} {dish.name} available",
             )
         dish.quantity -= dish_item.quantity
+        items.append((dish.id, dish_item.quantity, dish.price))
 
+    created_at = datetime.now()
     order = Order(
         user_id=current_user.id,
         special_requests=order_data.special_requests,
         status="pending",
-        created_at=datetime.now(),
-        updated_at=datetime.now(),
+        created_at=created_at,
+        updated_at=created_at,
     )
 
-    db.add(order)
+    shard_db.add(order)
+    # id заказа нужен для позиций
+    shard_db.flush()
+    order_id = order.id
+    shard_db.execute(insert(OrderDish).values([
+        {"order_id": order_id, "dish_id": dish_id, "quantity": quantity, "price": price}
+        for dish_id, quantity, price in items
+    ]))
+    record_sales(shard_db, items, created_at)
+    record_status_change(shard_db, None, "pending")
+    # Сначала шард: до коммита каталога пользователь не может переехать
+    # на другой шард. Без шардирования это одна и та же сессия.
+    shard_db.commit()
     db.commit()
-    db.refresh(order)
-    return {"order_id": order.id}
+    active_orders.add(
+        order_id,
+        current_user.id,
+        "pending",
+        created_at,
+        [(dish_id, quantity) for dish_id, quantity, _ in items],
+    )
+    hub.publish(order_id, "pending")
+    return {"order_id": order_id}
+
+
+@router.put("/status", response_model=OrderStatusBatchResponse)
+@query_budget(STATUS_UPDATE_QUERY_BUDGET)
+def update_order_statuses(
+    batch: OrderStatusBatchRequest,
+    current_user: User = Depends(get_current_user),
+    shards: ShardSessions = Depends(get_shards),
+):
+    # Check if the current user has the "manager" or "chef" role
+    if current_user.role not in ["manager", "chef"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to update the order status",
+        )
+    if len(batch.updates) > ORDER_STATUS_BATCH_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {ORDER_STATUS_BATCH_MAX} updates per request",
+        )
+
+    updates = []
+    seen = set()
+    for item in batch.updates:
+        if item.order_id in seen:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Order {item.order_id} appears more than once",
+            )
+        seen.add(item.order_id)
+        updates.append((item.order_id, item.status.value))
+
+    results = apply_sharded_status_updates(shards, updates)
+    shards.commit()
+    publish_results(results)
+    return {
+        "results": [
+            {"order_id": order_id, "status": order_status, "outcome": outcome}
+            for order_id, order_status, outcome in results
+        ]
+    }
 
 
 @router.put("/{order_id}/status", response_model=OrderStatusUpdateResponse)
+@query_budget(STATUS_UPDATE_QUERY_BUDGET)
 def update_order_status(
     order_id: int,
     status_data: OrderStatusUpdateRequest,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
 ):
     # Check if the current user has the "manager" or "chef" role
     if current_user.role not in ["manager", "chef"]:
@@ -141,25 +232,126 @@ def update_order_status(
             detail="You are not authorized to update the order status",
         )
 
-    order = db.query(Order).filter(Order.id == order_id).first()
+    result = None
+    if coalescer is not None:
+        # Склеивается с соседними обновлениями в одну пачку; None — ждущих
+        # склейки слишком много
+        result = coalescer.submit(order_id, status_data.status.value)
+    if result is None:
+        results = apply_sharded_status_updates(shards, [(order_id, status_data.status.value)])
+        shards.commit()
+        publish_results(results)
+        result = results[0]
+    _, order_status, outcome = result
+
+    if outcome == NOT_FOUND:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Order not found",
+        )
+    if outcome == INVALID_TRANSITION:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Order is already {order_status}",
+        )
+    return {"message": "Order status updated"}
+
+
+@router.get("/events")
+@query_budget(0)
+def stream_all_order_events(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+):
+    # Check if the current user has the "manager" or "chef" role
+    if current_user.role not in ["manager", "chef"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to subscribe to all orders",
+        )
+
+    queue = hub.subscribe()
+    return StreamingResponse(
+        stream_events(request, queue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/{order_id}/events")
+@query_budget(SHARD_COUNT)
+def stream_order_events(
+    order_id: int,
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+    shards: ShardSessions = Depends(get_read_shards),
+):
+    # Подписываемся до чтения статуса, чтобы не потерять переход между ними
+    queue = hub.subscribe(order_id)
+    _, order = find_order(shards, order_id)
+    # Сессии не должны держать соединения с базами всё время стрима
+    shards.close()
+    db.close()
     if not order:
+        hub.unsubscribe(queue)
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found",
         )
 
-    order.status = status_data.status
-    db.commit()
-    return {"message": "Order status updated"}
+    initial_event = {"order_id": order.id, "status": order.status}
+    return StreamingResponse(
+        stream_events(request, queue, initial_event),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
+@router.get("/active", response_model=ActiveOrdersResponse)
+@query_budget(0)
+def get_active_orders(
+    order_status: Optional[OrderStatus] = Query(None, alias="status"),
+    current_user: User = Depends(get_current_user),
+):
+    # Check if the current user has the "manager" or "chef" role
+    if current_user.role not in ["manager", "chef"]:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to get the list of active orders",
+        )
+
+    # Отдаётся из индекса процесса, без запросов к базе
+    orders, dishes = active_orders.snapshot(order_status.value if order_status else None)
+    return {
+        "orders": [
+            {
+                "id": order_id,
+                "user_id": user_id,
+                "status": active_status,
+                "created_at": to_datetime(created_at),
+                "dishes": [{"dish_id": dish_id, "quantity": quantity} for dish_id, quantity in items],
+            }
+            for order_id, user_id, active_status, created_at, items in orders
+        ],
+        "dishes": [
+            dict(dish_id=dish_id, **dict(zip(ACTIVE_STATUSES, units)))
+            for dish_id, units in dishes
+        ],
+    }
 
 
 @router.get("/{order_id}", response_model=OrderResponce)
+@query_budget(2 * SHARD_COUNT)
 def get_order(
     order_id: int,
+    include_archived: bool = False,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_read_shards),
 ):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    _, order = find_order(shards, order_id)
+    if not order and include_archived:
+        _, order = find_order(shards, order_id, OrderArchive)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -168,10 +360,49 @@ def get_order(
     return order
 
 
-@router.get("", response_model=OrderListResponse)
+def shard_orders_versions(db: Session, include_archived: bool, start: Optional[datetime], end: Optional[datetime]) -> list:
+    # Версии горячей таблицы и архива для ETag
+    queries = []
+    for model in (Order, OrderArchive) if include_archived else (Order,):
+        query = select(*version_columns(model.updated_at))
+        if start is not None:
+            query = query.where(model.created_at >= start)
+        if end is not None:
+            query = query.where(model.created_at < end)
+        queries.append(query)
+    return db.execute(union_all(*queries)).all()
+
+
+def list_shard_orders(db: Session, include_archived: bool, start: Optional[datetime], end: Optional[datetime]) -> list:
+    orders = db.query(Order)
+    if start is not None:
+        orders = orders.filter(Order.created_at >= start)
+    if end is not None:
+        orders = orders.filter(Order.created_at < end)
+    orders = orders.order_by(Order.created_at).all()
+
+    if include_archived:
+        # Границы по created_at отсекают ненужные месячные секции архива
+        archived = db.query(OrderArchive)
+        if start is not None:
+            archived = archived.filter(OrderArchive.created_at >= start)
+        if end is not None:
+            archived = archived.filter(OrderArchive.created_at < end)
+        archived = archived.order_by(OrderArchive.created_at).all()
+        orders = list(heapq.merge(archived, orders, key=lambda order: order.created_at))
+    return orders
+
+
+@router.get("", response_model=OrderListResponse, dependencies=[Depends(order_list_limit)])
+@query_budget(3 * SHARD_COUNT)
 def get_all_orders(
+    request: Request,
+    response: Response,
+    include_archived: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_read_shards),
 ):
     # Check if the current user has the "manager" or "chef" role
     if current_user.role not in ["manager", "chef"]:
@@ -180,7 +411,29 @@ def get_all_orders(
             detail="You are not authorized to get the list of all orders",
         )
 
-    orders = db.query(Order).all()
+    # Неизменившийся список не читается с шардов целиком
+    shard_versions = shards.map(
+        lambda db: shard_orders_versions(db, include_archived, start, end),
+    )
+    not_modified = conditional_list(request, response, [
+        version for versions in shard_versions for version in versions
+    ])
+    if not_modified:
+        return not_modified
+
+    # Шарды опрашиваются параллельно, списки сливаются по created_at.
+    # Заказ, который как раз переносится между шардами, может попасться
+    # дважды — повтор отбрасывается.
+    shard_orders = shards.map(
+        lambda db: list_shard_orders(db, include_archived, start, end),
+    )
+    orders = []
+    seen = set()
+    for order in heapq.merge(*shard_orders, key=lambda order: order.created_at):
+        if order.id not in seen:
+            seen.add(order.id)
+            orders.append(order)
+
     if not orders:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -190,10 +443,11 @@ def get_all_orders(
 
 
 @router.delete("/{order_id}", response_model=OrderResponce)
+@query_budget(6 + SHARD_COUNT)
 def delete_order(
     order_id: int,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    shards: ShardSessions = Depends(get_shards),
 ):
     # Check if the current user has the "manager" role
     if current_user.role != "manager":
@@ -202,12 +456,32 @@ def delete_order(
             detail="You are not authorized to delete orders",
         )
 
-    order = db.query(Order).filter(Order.id == order_id).first()
+    shard, order = find_order(shards, order_id)
     if not order:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Order not found",
         )
+    db = shards[shard]
+    record_status_change(db, order.status, None)
+    if order.status != "cancelled":
+        record_order_sales(db, order.id, order.created_at, sign=-1)
     db.delete(order)
     db.commit()
-    return order
\ No newline at end of file
+    active_orders.remove(order_id)
+    return order
+
+
+def warm_catalog_queries(db: Session):
+    # Блокировка блюд в create_order; строк с id 0 нет, блокировать нечего
+    db.query(Dish).filter(Dish.id.in_([0])).order_by(Dish.id).with_for_update().all()
+
+
+def warm_shard_queries(db: Session):
+    db.query(Order).filter(Order.id == 0).first()
+    shard_orders_versions(db, False, None, None)
+
+
+warmup.register(warm_catalog_queries, SessionLocal)
+for session_factory in read_session_factories():
+    warmup.register(warm_shard_queries, session_factory)
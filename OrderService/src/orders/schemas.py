@@ -38,6 +38,23 @@ class OrderStatusUpdateResponse(BaseModel):
 class OrderStatusUpdateErrorResponse(BaseModel):
     error: str
 
+class OrderStatusBatchItem(BaseModel):
+    order_id: int
+    status: OrderStatus
+
+class OrderStatusBatchRequest(BaseModel):
+    updates: conlist(OrderStatusBatchItem, min_items=1)
+
+class OrderStatusBatchResult(BaseModel):
+    order_id: int
+    # Текущий статус заказа, None — заказ не найден
+    status: Optional[OrderStatus]
+    # updated, unchanged, not_found или invalid_transition
+    outcome: str
+
+class OrderStatusBatchResponse(BaseModel):
+    results: list[OrderStatusBatchResult]
+
 class OrderResponce(BaseModel):
     id: int
     user_id: int
@@ -50,4 +67,21 @@ class OrderResponce(BaseModel):
         orm_mode = True
 
 class OrderListResponse(BaseModel):
-    orders: list[OrderResponce]
\ No newline at end of file
+    orders: list[OrderResponce]
+
+class ActiveOrderResponse(BaseModel):
+    id: int
+    user_id: int
+    status: OrderStatus
+    created_at: datetime
+    dishes: list[DishItem]
+
+class ActiveDishResponse(BaseModel):
+    dish_id: int
+    # Порций в заказах со статусом pending и in_progress
+    pending: int
+    in_progress: int
+
+class ActiveOrdersResponse(BaseModel):
+    orders: list[ActiveOrderResponse]
+    dishes: list[ActiveDishResponse]
@@ -0,0 +1,337 @@
+# Генератор синтетических данных для нагрузочных тестов: пользователи, блюда,
+# заказы и их позиции. Данные детерминированы: одинаковые --seed, размеры
+# и --end дают одинаковые строки. Пользователи совпадают с теми, что создаёт
+# AuthService/src/seed.py с тем же --seed и --users.
+# Популярность блюд и активность пользователей распределены по Ципфу,
+# заказы последнего часа ещё открыты. Загрузка через COPY в несколько процессов.
+# С ORDER_SHARDS заказы раскладываются по шардам пользователей (sharding.py).
+# Запуск из каталога src:
+#   python seed.py --users 1000000 --dishes 2000 --orders 5000000 --seed 42 --truncate
+import argparse
+import io
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from multiprocessing import Pool
+
+import bcrypt
+import psycopg2
+
+from database import DATABASE_URL, create_all_tables
+from sharding import (
+    SHARD_ID_STRIDE,
+    SHARDED,
+    align_sequences,
+    create_shard_tables,
+    default_shard,
+    shards,
+)
+from analytics.rebuild import rebuild_all
+
+# bcrypt считается один раз для небольшого набора паролей; пользователь
+# с номером i получает пароль password{i % PASSWORD_POOL_SIZE}
+PASSWORD_POOL_SIZE = 16
+BCRYPT_ROUNDS = 12
+BCRYPT_ALPHABET = "./ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+SEED_EPOCH = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+# Показатели распределения Ципфа
+DISH_SKEW = 1.1
+USER_SKEW = 0.9
+MAX_ITEMS = 5
+ITEM_COUNT_WEIGHTS = (40, 30, 15, 10, 5)
+QUANTITY_WEIGHTS = (70, 20, 10)
+CANCELLED_SHARE = 0.06
+SPECIAL_REQUESTS_SHARE = 0.1
+# Заказы моложе этого возраста ещё готовятся
+OPEN_WINDOW = timedelta(hours=1)
+
+DISH_ADJECTIVES = (
+    "Классический", "Острый", "Домашний", "Сливочный", "Копчёный", "Запечённый",
+    "Жареный", "Овощной", "Грибной", "Сырный", "Пряный", "Лёгкий",
+)
+DISH_BASES = (
+    "борщ", "суп", "салат", "плов", "бургер", "пирог", "омлет", "рамен",
+    "ризотто", "стейк", "блин", "шашлык", "гуляш", "карри", "тако", "сэндвич",
+)
+DISH_EXTRAS = (
+    "с курицей", "с говядиной", "с грибами", "с сыром", "с зеленью",
+    "с томатами", "с беконом", "с лососем", "с креветками", "с тыквой",
+)
+SPECIAL_REQUESTS = (
+    "Без лука", "Поострее", "Без глютена", "Соус отдельно", "Без орехов",
+    "Побольше зелени", "Без соли",
+)
+
+USER_COLUMNS = "(id, username, email, password_hash, role, created_at, updated_at)"
+DISH_COLUMNS = "(id, name, description, price, quantity, prep_time)"
+ORDER_COLUMNS = "(id, user_id, status, special_requests, created_at, updated_at)"
+ORDER_DISH_COLUMNS = "(id, order_id, dish_id, quantity, price)"
+
+
+def password_hashes(seed: int) -> list:
+    # Соль фиксирована сидом, поэтому хэши воспроизводимы
+    rng = random.Random(f"{seed}-bcrypt")
+    salt = "".join(rng.choice(BCRYPT_ALPHABET) for _ in range(21)) + rng.choice(".Oeu")
+    prefix = f"$2b${BCRYPT_ROUNDS:02d}${salt}".encode()
+    return [
+        bcrypt.hashpw(f"password{n}".encode(), prefix).decode()
+        for n in range(PASSWORD_POOL_SIZE)
+    ]
+
+
+def user_role(user_id: int) -> str:
+    if user_id % 10000 == 0:
+        return "manager"
+    if user_id % 1000 == 0:
+        return "chef"
+    return "customer"
+
+
+def user_rows(start: int, stop: int, hashes: list, total: int):
+    for user_id in range(start, stop):
+        created_at = SEED_EPOCH + timedelta(seconds=(user_id * 31536000) // total)
+        yield (
+            user_id,
+            f"user{user_id}",
+            f"user{user_id}@example.com",
+            hashes[user_id % len(hashes)],
+            user_role(user_id),
+            created_at.isoformat(),
+            created_at.isoformat(),
+        )
+
+
+def dish_rows(total: int, seed: int) -> list:
+    rng = random.Random(f"{seed}-dishes")
+    combinations = len(DISH_ADJECTIVES) * len(DISH_BASES) * len(DISH_EXTRAS)
+    rows = []
+    for dish_id in range(1, total + 1):
+        n = dish_id - 1
+        adjective = DISH_ADJECTIVES[n % len(DISH_ADJECTIVES)]
+        base = DISH_BASES[(n // len(DISH_ADJECTIVES)) % len(DISH_BASES)]
+        extra = DISH_EXTRAS[(n // (len(DISH_ADJECTIVES) * len(DISH_BASES))) % len(DISH_EXTRAS)]
+        name = f"{adjective} {base} {extra}"
+        if n >= combinations:
+            name += f" №{n // combinations + 1}"
+        rows.append((
+            dish_id,
+            name,
+            f"{adjective} {base} {extra}, готовится по рецепту шефа",
+            (Decimal(rng.randrange(15000, 250000, 10)) / 100).quantize(Decimal("0.01")),
+            rng.randrange(0, 500),
+            max(60, int(rng.lognormvariate(5.6, 0.5))),
+        ))
+    return rows
+
+
+def zipf_cum_weights(total: int, skew: float, rng: random.Random):
+    # Ранги популярности случайно перемешаны, чтобы популярными были
+    # не просто первые id
+    ids = list(range(1, total + 1))
+    rng.shuffle(ids)
+    cum_weights = []
+    acc = 0.0
+    for rank in range(1, total + 1):
+        acc += 1.0 / rank ** skew
+        cum_weights.append(acc)
+    return ids, cum_weights
+
+
+# Распределения строятся один раз на процесс в init_worker
+_dish_ids = None
+_dish_weights = None
+_dish_prices = None
+_user_ids = None
+_user_weights = None
+
+
+def init_worker(seed: int, users: int, dish_prices: list):
+    global _dish_ids, _dish_weights, _dish_prices, _user_ids, _user_weights
+    _dish_prices = dish_prices
+    _dish_ids, _dish_weights = zipf_cum_weights(len(dish_prices), DISH_SKEW, random.Random(f"{seed}-dish-rank"))
+    # Заказы оформляют только покупатели
+    customers = [user_id for user_id in range(1, users + 1) if user_role(user_id) == "customer"]
+    rank_ids, _user_weights = zipf_cum_weights(len(customers), USER_SKEW, random.Random(f"{seed}-user-rank"))
+    _user_ids = [customers[i - 1] for i in rank_ids]
+
+
+def order_rows(start: int, stop: int, seed: int, total: int, first_at: datetime, end_at: datetime):
+    # Заказы и позиции по шардам: {шард: (заказы, позиции)}
+    rng = random.Random(f"{seed}-orders-{start}")
+    step = (end_at - first_at) / total
+    user_ids = rng.choices(_user_ids, cum_weights=_user_weights, k=stop - start)
+    rows = {}
+    for offset, n in enumerate(range(start, stop)):
+        user_id = user_ids[offset]
+        shard = default_shard(user_id)
+        # На шардах id заказа указывает на шард, как у созданных сервисом
+        order_id = (n - 1) * SHARD_ID_STRIDE + shard + 1 if SHARDED else n
+        orders, items = rows.setdefault(shard, ([], []))
+        created_at = first_at + step * (n - 1 + rng.random())
+        if end_at - created_at < OPEN_WINDOW:
+            status = rng.choice(("pending", "in_progress"))
+            updated_at = created_at
+        else:
+            status = "cancelled" if rng.random() < CANCELLED_SHARE else "completed"
+            updated_at = created_at + timedelta(seconds=rng.randrange(300, 3600))
+        # Как и POST /orders, пустая строка вместо NULL: её ждёт OrderResponce
+        special_requests = rng.choice(SPECIAL_REQUESTS) if rng.random() < SPECIAL_REQUESTS_SHARE else ""
+        orders.append((
+            order_id,
+            user_id,
+            status,
+            special_requests,
+            created_at.isoformat(),
+            updated_at.isoformat(),
+        ))
+
+        item_count = rng.choices(range(1, MAX_ITEMS + 1), weights=ITEM_COUNT_WEIGHTS)[0]
+        dish_ids = set()
+        for dish_id in rng.choices(_dish_ids, cum_weights=_dish_weights, k=item_count):
+            if dish_id in dish_ids:
+                continue
+            dish_ids.add(dish_id)
+            quantity = rng.choices((1, 2, 3), weights=QUANTITY_WEIGHTS)[0]
+            # id позиций вычисляются из номера заказа, чтобы процессы не пересекались
+            items.append((
+                (n - 1) * MAX_ITEMS + len(dish_ids),
+                order_id,
+                dish_id,
+                quantity,
+                _dish_prices[dish_id - 1],
+            ))
+    return rows
+
+
+def copy_rows(cursor, table: str, columns: str, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} {columns} FROM STDIN", buffer)
+
+
+def load_users(args: tuple) -> int:
+    start, stop, hashes, total = args
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        with connection, connection.cursor() as cursor:
+            copy_rows(cursor, '"user"', USER_COLUMNS, user_rows(start, stop, hashes, total))
+    finally:
+        connection.close()
+    return stop - start
+
+
+def load_orders(args: tuple) -> int:
+    loaded = 0
+    for shard, (orders, items) in order_rows(*args).items():
+        connection = psycopg2.connect(shards[shard][0])
+        try:
+            with connection, connection.cursor() as cursor:
+                copy_rows(cursor, '"order"', ORDER_COLUMNS, orders)
+                copy_rows(cursor, "order_dish", ORDER_DISH_COLUMNS, items)
+        finally:
+            connection.close()
+        loaded += len(orders)
+    return loaded
+
+
+def truncate_shard(url: str):
+    connection = psycopg2.connect(url)
+    try:
+        with connection, connection.cursor() as cursor:
+            cursor.execute(
+                'TRUNCATE order_dish, "order", order_dish_archive, order_archive, '
+                'dish_sales_rollup, order_status_count RESTART IDENTITY'
+            )
+    finally:
+        connection.close()
+
+
+def analyze(url: str):
+    connection = psycopg2.connect(url)
+    try:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+    finally:
+        connection.close()
+
+
+def chunks(total: int, size: int):
+    for start in range(1, total + 1, size):
+        yield start, min(start + size, total + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load synthetic data into the OrderService database")
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--dishes", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=5000000)
+    parser.add_argument("--days", type=int, default=365, help="Orders are spread over this many days")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=None,
+                        help="Time of the newest order (ISO 8601), defaults to the current hour")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=100000)
+    parser.add_argument("--truncate", action="store_true", help="Remove existing data first")
+    args = parser.parse_args()
+
+    end_at = args.end or datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if end_at.tzinfo is None:
+        end_at = end_at.replace(tzinfo=timezone.utc)
+    first_at = end_at - timedelta(days=args.days)
+
+    started = time.monotonic()
+    create_all_tables()
+    create_shard_tables()
+    hashes = password_hashes(args.seed)
+    dishes = dish_rows(args.dishes, args.seed)
+
+    connection = psycopg2.connect(DATABASE_URL)
+    try:
+        with connection, connection.cursor() as cursor:
+            if args.truncate:
+                cursor.execute(
+                    'TRUNCATE order_dish, "order", order_dish_archive, order_archive, '
+                    'dish_sales_rollup, order_status_count, user_shard, dish, "session", "user" RESTART IDENTITY'
+                )
+            copy_rows(cursor, "dish", DISH_COLUMNS, dishes)
+        if args.truncate:
+            for url, _, _ in shards:
+                if url != DATABASE_URL:
+                    truncate_shard(url)
+
+        user_tasks = [(start, stop, hashes, args.users) for start, stop in chunks(args.users, args.chunk_size)]
+        order_tasks = [
+            (start, stop, args.seed, args.orders, first_at, end_at)
+            for start, stop in chunks(args.orders, args.chunk_size)
+        ]
+        dish_prices = [row[3] for row in dishes]
+        with Pool(args.workers, initializer=init_worker, initargs=(args.seed, args.users, dish_prices)) as pool:
+            users = sum(pool.imap_unordered(load_users, user_tasks))
+            print(f"Loaded {users} users and {len(dishes)} dishes")
+            orders = sum(pool.imap_unordered(load_orders, order_tasks))
+            print(f"Loaded {orders} orders")
+
+        with connection, connection.cursor() as cursor:
+            for table in ('"user"', "dish", '"order"', "order_dish"):
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1)) FROM {table}"
+                )
+    finally:
+        connection.close()
+    # Новые заказы на шардах получают id с шагом SHARD_ID_STRIDE после загруженных
+    align_sequences(force=True)
+    for url in {url for url, _, _ in shards} | {DATABASE_URL}:
+        analyze(url)
+
+    rebuild_all()
+    print(f"Done in {time.monotonic() - started:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
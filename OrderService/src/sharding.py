@@ -0,0 +1,248 @@
+# Шардирование заказов по user_id. Каталог (блюда, пользователи, справочник
+# user_shard) остаётся в основной базе DB_HOST, а заказы с позициями, их архив
+# и агрегаты продаж лежат в одной из баз ORDER_SHARDS. Без ORDER_SHARDS
+# единственный шард — сама основная база, и всё работает как раньше.
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import Depends
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session, sessionmaker
+from dotenv import load_dotenv
+
+import database
+from models import (
+    DishSalesRollup,
+    Order,
+    OrderArchive,
+    OrderDish,
+    OrderDishArchive,
+    OrderStatusCount,
+)
+
+load_dotenv()
+
+# Базы шардов через запятую: host:port или host:port/dbname
+ORDER_SHARDS = [shard.strip() for shard in os.getenv("ORDER_SHARDS", "").split(",") if shard.strip()]
+# Наибольшее число шардов. id заказов и позиций, созданных на шарде k,
+# дают остаток k + 1 при делении на SHARD_ID_STRIDE — по id угадывается шард
+SHARD_ID_STRIDE = 64
+# Пространство имён advisory-блокировок пользователей на время переноса
+USER_LOCK_NAMESPACE = 0x5348
+
+SHARD_TABLES = [
+    Order.__table__,
+    OrderDish.__table__,
+    OrderArchive.__table__,
+    OrderDishArchive.__table__,
+    DishSalesRollup.__table__,
+    OrderStatusCount.__table__,
+]
+
+
+def _shard_url(shard: str) -> str:
+    address, _, name = shard.partition("/")
+    return f"postgresql://{database.DB_USER}:{database.DB_PASSWORD}@{address}/{name or database.DB_NAME}"
+
+
+# (url, engine, фабрика сессий); шард в основной базе использует её engine
+shards = []
+for shard in ORDER_SHARDS:
+    url = _shard_url(shard)
+    if url == database.DATABASE_URL:
+        shards.append((url, database.engine, database.SessionLocal))
+    else:
+        shard_engine = create_engine(url)
+        shards.append((url, shard_engine, sessionmaker(autocommit=False, autoflush=False, bind=shard_engine)))
+if not shards:
+    shards.append((database.DATABASE_URL, database.engine, database.SessionLocal))
+
+SHARD_COUNT = len(shards)
+SHARDED = SHARD_COUNT > 1
+if SHARD_COUNT > SHARD_ID_STRIDE:
+    raise EnvironmentError(f"At most {SHARD_ID_STRIDE} order shards are supported")
+
+_executor = ThreadPoolExecutor(max_workers=4 * SHARD_COUNT, thread_name_prefix="shard")
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    # Jump consistent hash: при добавлении шарда переезжает лишь 1/N пользователей
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+def default_shard(user_id: int) -> int:
+    return jump_hash(user_id, SHARD_COUNT)
+
+
+def route_user(db: Session, user_id: int) -> int:
+    # Шард для новых заказов пользователя. Разделяемая блокировка держится до
+    # конца транзакции каталога, поэтому перенос пользователя между шардами
+    # (orders.rebalance) ждёт завершения его текущих записей.
+    if not SHARDED:
+        return 0
+    shard = db.execute(
+        text(
+            "SELECT pg_advisory_xact_lock_shared(:namespace, :user_id), "
+            "(SELECT shard FROM user_shard WHERE user_id = :user_id)"
+        ),
+        {"namespace": USER_LOCK_NAMESPACE, "user_id": user_id},
+    ).first()[1]
+    if shard is None or shard >= SHARD_COUNT:
+        return default_shard(user_id)
+    return shard
+
+
+def guess_order_shard(order_id: int) -> int:
+    # Шард, на котором заказ создан; перенесённые и старые заказы ищутся на остальных
+    shard = (order_id - 1) % SHARD_ID_STRIDE
+    return shard if shard < SHARD_COUNT else 0
+
+
+class ShardSessions:
+    # Сессии шардов в пределах одного запроса, открываются по мере надобности.
+    # Шард в основной базе использует сессию запроса (для чтения — с реплики).
+    def __init__(self, main_db: Session = None):
+        self.main_db = main_db
+        self._sessions = {}
+
+    def __getitem__(self, shard: int) -> Session:
+        session = self._sessions.get(shard)
+        if session is None:
+            _, shard_engine, session_factory = shards[shard]
+            if self.main_db is not None and shard_engine is database.engine:
+                session = self.main_db
+            else:
+                session = session_factory()
+            self._sessions[shard] = session
+        return session
+
+    def map(self, fn, shard_numbers=None, *iterables) -> list:
+        # fn(session, *args) на нескольких шардах параллельно, как встроенный
+        # map; результаты в порядке shard_numbers
+        if shard_numbers is None:
+            shard_numbers = range(SHARD_COUNT)
+        calls = [
+            (self[shard], *args)
+            for shard, *args in zip(shard_numbers, *iterables)
+        ]
+        if len(calls) == 1:
+            return [fn(*calls[0])]
+        # Потоки получают копию контекста: спаны и счётчик запросов текущего запроса
+        futures = [
+            _executor.submit(contextvars.copy_context().run, fn, *call)
+            for call in calls
+        ]
+        return [future.result() for future in futures]
+
+    def commit(self):
+        for shard in sorted(self._sessions):
+            self._sessions[shard].commit()
+
+    def close(self):
+        for session in self._sessions.values():
+            if session is not self.main_db:
+                session.close()
+        self._sessions.clear()
+
+
+def get_shards(db: Session = Depends(database.get_db)):
+    sessions = ShardSessions(db)
+    try:
+        yield sessions
+    finally:
+        sessions.close()
+
+
+def get_read_shards(db: Session = Depends(database.get_read_db)):
+    sessions = ShardSessions(db)
+    try:
+        yield sessions
+    finally:
+        sessions.close()
+
+
+def read_session_factories() -> list:
+    # Через какие фабрики get_read_shards читает шарды: шард в основной базе
+    # читается с реплики
+    return [
+        database.ReplicaSessionLocal if shard_engine is database.engine else session_factory
+        for _, shard_engine, session_factory in shards
+    ]
+
+
+def find_order(sessions: ShardSessions, order_id: int, model=Order):
+    # Возвращает (шард, заказ) или (None, None)
+    def lookup(session):
+        return session.query(model).filter(model.id == order_id).first()
+
+    home = guess_order_shard(order_id)
+    order = lookup(sessions[home])
+    if order is not None:
+        return home, order
+    others = [shard for shard in range(SHARD_COUNT) if shard != home]
+    if not others:
+        return None, None
+    for shard, order in zip(others, sessions.map(lookup, others)):
+        if order is not None:
+            return shard, order
+    return None, None
+
+
+def _max_id(conn, tables: tuple) -> int:
+    return max(
+        conn.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM "{table}"')).scalar()
+        for table in tables
+    )
+
+
+def align_sequences(force: bool = False):
+    # Переводит последовательности id заказов и позиций на шаг SHARD_ID_STRIDE
+    # так, чтобы id не пересекались между шардами и были больше всех
+    # существующих. Выполняется при первом запуске с шардами, а с force —
+    # каждый раз (после загрузки данных).
+    if not SHARDED:
+        return
+    with database.engine.begin() as lock_conn:
+        # Несколько процессов сервиса стартуют одновременно
+        lock_conn.execute(text("SELECT pg_advisory_xact_lock(:namespace, 0)"), {"namespace": USER_LOCK_NAMESPACE})
+        _align_sequences(force)
+
+
+def _align_sequences(force: bool):
+    for table, archive in (("order", "order_archive"), ("order_dish", "order_dish_archive")):
+        sequences = []
+        global_max = 0
+        for _, shard_engine, _ in shards:
+            with shard_engine.connect() as conn:
+                sequence = conn.execute(
+                    text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                    {"table": f'"{table}"'},
+                ).scalar()
+                increment = conn.execute(
+                    text("SELECT increment_by FROM pg_sequences WHERE format('%I.%I', schemaname, sequencename) = :sequence"),
+                    {"sequence": sequence},
+                ).scalar()
+                sequences.append((sequence, increment))
+                global_max = max(global_max, _max_id(conn, (table, archive)))
+
+        for shard, ((_, shard_engine, _), (sequence, increment)) in enumerate(zip(shards, sequences)):
+            if increment == SHARD_ID_STRIDE and not force:
+                continue
+            restart = global_max + 1 + (shard - global_max) % SHARD_ID_STRIDE
+            with shard_engine.begin() as conn:
+                conn.execute(text(
+                    f"ALTER SEQUENCE {sequence} INCREMENT BY {SHARD_ID_STRIDE} RESTART WITH {restart}"
+                ))
+
+
+def create_shard_tables():
+    for _, shard_engine, _ in shards:
+        if shard_engine is not database.engine:
+            database.Base.metadata.create_all(bind=shard_engine, tables=SHARD_TABLES)
+    align_sequences()
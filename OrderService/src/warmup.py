@@ -0,0 +1,151 @@
+# Прогрев процесса после старта, чтобы первые запросы нового воркера не
+# платили за холодный старт: соединения пула открываются заранее (TCP и
+# аутентификация в Postgres), формы горячих запросов выполняются по разу и
+# попадают в кэш компиляции SQLAlchemy, модели ответов один раз проходят
+# валидацию (первая проверка EmailStr, например, подгружает таблицы idna).
+# Пока прогрев не закончен, GET /ready отвечает 503.
+import asyncio
+import logging
+import os
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from enum import Enum
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, EmailStr
+from pydantic.fields import MAPPING_LIKE_SHAPES, SHAPE_SINGLETON, ModelField
+
+# Сколько соединений открыть заранее в каждой базе (не больше pool_size)
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "5"))
+# Пауза перед повтором, если база ещё недоступна
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "2"))
+
+logger = logging.getLogger(__name__)
+
+# Подклассы раньше базовых классов
+SAMPLE_VALUES = [
+    (bool, True),
+    (EmailStr, "warmup@example.com"),
+    (str, "warmup"),
+    (int, 1),
+    (float, 1.0),
+    (Decimal, Decimal("1.00")),
+    (datetime, datetime(2024, 1, 1, tzinfo=timezone.utc)),
+    (date, date(2024, 1, 1)),
+]
+
+_warmers = []
+_stats = {"ready": False, "attempts": 0, "connections": 0, "warmers": 0, "models": 0, "duration_ms": None}
+
+
+def register(warmer, session_factory=None):
+    # С session_factory warmer(db) выполняет формы запросов горячих
+    # обработчиков так же, как они, но с аргументами, под которые ничего не
+    # подходит; сессия затем закрывается. Без неё вызывается warmer()
+    _warmers.append((warmer, session_factory))
+
+
+def fill_pool(engine, size: int) -> int:
+    # Соединения открываются параллельно и сразу возвращаются в пул
+    size = min(size, engine.pool.size())
+    if size <= 0:
+        return 0
+    with ThreadPoolExecutor(max_workers=size, thread_name_prefix="warmup") as executor:
+        futures = [executor.submit(engine.connect) for _ in range(size)]
+    for future in futures:
+        if future.exception() is None:
+            future.result().close()
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+    return size
+
+
+def run_warmers() -> int:
+    warmers = 0
+    for warmer, session_factory in _warmers:
+        if session_factory is None:
+            warmer()
+        else:
+            db = session_factory()
+            try:
+                warmer(db)
+            finally:
+                db.close()
+        warmers += 1
+    return warmers
+
+
+def sample_value(field: ModelField):
+    # Правдоподобное значение поля модели ответа; None, если тип незнаком
+    if field.shape in MAPPING_LIKE_SHAPES:
+        return {}
+    if field.shape != SHAPE_SINGLETON:
+        return [sample_value(field.sub_fields[0])] if field.sub_fields else []
+    if field.sub_fields:
+        # Union: первый вариант
+        return sample_value(field.sub_fields[0])
+    type_ = field.type_
+    if typing.get_origin(type_) is typing.Literal:
+        return typing.get_args(type_)[0]
+    if not isinstance(type_, type):
+        return None
+    if issubclass(type_, BaseModel):
+        return {name: sample_value(model_field) for name, model_field in type_.__fields__.items()}
+    if issubclass(type_, Enum):
+        return next(iter(type_))
+    for base, value in SAMPLE_VALUES:
+        if issubclass(type_, base):
+            return value
+    return None
+
+
+def warm_response_models(app) -> int:
+    # Та же валидация и кодирование, что в fastapi.routing.serialize_response
+    models = 0
+    for route in app.routes:
+        if not isinstance(route, APIRoute) or route.secure_cloned_response_field is None:
+            continue
+        value, errors = route.secure_cloned_response_field.validate(
+            sample_value(route.response_field), {}, loc=("response",),
+        )
+        if errors:
+            logger.debug("Warm-up sample for %s %s is invalid: %s", route.methods, route.path, errors)
+        else:
+            jsonable_encoder(value)
+        models += 1
+    return models
+
+
+def warm(app, engines):
+    started = time.perf_counter()
+    _stats["connections"] = sum(fill_pool(engine, WARMUP_CONNECTIONS) for engine in engines)
+    _stats["warmers"] = run_warmers()
+    _stats["models"] = warm_response_models(app)
+    _stats["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    _stats["ready"] = True
+    logger.info("Warm-up finished in %s ms", _stats["duration_ms"])
+
+
+async def run_warmup(app, engines):
+    # Повторяется, пока не получится: без базы сервис не готов
+    while True:
+        _stats["attempts"] += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, warm, app, engines)
+            return
+        except Exception:
+            logger.exception("Warm-up failed")
+        await asyncio.sleep(WARMUP_RETRY_INTERVAL)
+
+
+def is_ready() -> bool:
+    return _stats["ready"]
+
+
+def collect_metrics() -> dict:
+    return dict(_stats)
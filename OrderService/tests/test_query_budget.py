@@ -0,0 +1,99 @@
+import os
+import uuid
+
+import jwt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from query_budget import QUERY_REPEAT_THRESHOLD, QueryBudgetExceeded, QueryBudgetMiddleware, query_budget
+
+
+@pytest.fixture
+def manager(app, monkeypatch):
+    # Пользователь и блюдо создаются в базе; AuthService не нужен,
+    # get_user_by_id возвращает пользователя фикстуры
+    import database
+    import orders.router
+    from models import Dish, Order, User
+    from sharding import SHARD_COUNT, ShardSessions
+
+    suffix = uuid.uuid4().hex[:12]
+    db = database.SessionLocal()
+    user = User(username=f"budget-{suffix}", email=f"budget-{suffix}@example.com", password_hash="-", role="manager")
+    dish = Dish(name=f"budget-{suffix}", price=10, quantity=100)
+    db.add_all([user, dish])
+    db.commit()
+    db.refresh(user)
+    db.refresh(dish)
+    db.expunge_all()
+    monkeypatch.setattr(orders.router, "get_user_by_id", lambda user_id: user if user_id == user.id else None)
+    yield user, dish
+
+    sessions = ShardSessions(db)
+    try:
+        for shard in range(SHARD_COUNT):
+            for order in sessions[shard].query(Order).filter(Order.user_id == user.id):
+                sessions[shard].delete(order)
+        sessions.commit()
+        db.query(Dish).filter(Dish.id == dish.id).delete()
+        db.query(User).filter(User.id == user.id).delete()
+        db.commit()
+    finally:
+        sessions.close()
+        db.close()
+
+
+def auth(user) -> dict:
+    token = jwt.encode({"user_id": user.id}, os.environ["JWT_SECRET"], algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_create_and_list_orders_within_budget(app, manager):
+    user, dish = manager
+    client = TestClient(app)
+
+    response = client.post("/orders", json={"dishes": [{"dish_id": dish.id, "quantity": 2}]}, headers=auth(user))
+    assert response.status_code == 201
+
+    response = client.get("/orders", headers=auth(user))
+    assert response.status_code == 200
+    assert response.json()["orders"]
+
+    # 304 тоже укладывается в бюджет
+    response = client.get("/orders", headers={**auth(user), "If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+
+def test_exceeded_budget_fails_before_response(app, manager, monkeypatch):
+    import orders.router
+
+    user, dish = manager
+    monkeypatch.setattr(orders.router.create_order, "query_budget", 1)
+    client = TestClient(app, raise_server_exceptions=False)
+
+    response = client.post("/orders", json={"dishes": [{"dish_id": dish.id, "quantity": 1}]}, headers=auth(user))
+    assert response.status_code == 500
+
+
+def test_repeated_statement_is_reported(app):
+    import database
+    from models import Dish
+
+    n_plus_one = FastAPI()
+    n_plus_one.add_middleware(QueryBudgetMiddleware)
+
+    @n_plus_one.get("/")
+    @query_budget(QUERY_REPEAT_THRESHOLD + 1)
+    def one_query_per_dish():
+        db = database.SessionLocal()
+        try:
+            for dish_id in range(QUERY_REPEAT_THRESHOLD + 1):
+                db.execute(select(Dish.id).where(Dish.id == dish_id))
+        finally:
+            db.close()
+        return {}
+
+    with pytest.raises(QueryBudgetExceeded, match="statement executed"):
+        TestClient(n_plus_one).get("/")